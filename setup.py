@@ -17,5 +17,11 @@ setup(
     long_description=long_description,
     long_description_content_type='text/markdown',
     url='github.com/ssclafani949/Submitter',
-    install_requires=['numpy'],
+    extras_require={
+        # .npy shard outputs in submitter.merge_shards
+        'numpy': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': ['submitter = submitter.cli:main'],
+    },
 )
@@ -1,4 +1,16 @@
 
-from . import submitter
 
-Submitter = submitter.Submitter
+
+def __getattr__ (name):
+    """Import the submitter module on first use of `Submitter`.
+
+    Tools that need none of it, like submitter.fake (run for every fake
+    scheduler command), then start without loading it.
+    """
+    if name in ('Submitter', 'submitter'):
+        import importlib
+        submitter = importlib.import_module ('.submitter', __name__)
+        globals ()['Submitter'] = submitter.Submitter
+        return globals ()[name]
+    raise AttributeError (
+        'module {0!r} has no attribute {1!r}'.format (__name__, name))
@@ -0,0 +1,5 @@
+# __main__.py
+
+from .cli import main
+
+main ()
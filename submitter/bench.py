@@ -0,0 +1,212 @@
+# bench.py
+
+
+from __future__ import print_function
+
+__doc__ = """Offline benchmarks for the submitter.
+
+The makespan benchmark submits a sweep of sleep jobs through one backend,
+with the cluster commands replaced by the local stand-ins in
+`submitter.fake`, and reports how long the whole sweep took::
+
+    python -m submitter.bench makespan --backend npx4 --jobs 200 \\
+        --duration .5 --slots 8 --latency 1 --eviction .1
+
+Every backend that goes through ssh, rsync, condor_submit_dag, qsub or sbatch
+can be run this way, so end-to-end changes can be timed and checked for
+regressions without cluster access.
+
+The imports benchmark times importing the package in fresh interpreters, and
+fails if that loads a forbidden module (NumPy by default) or takes too long::
+
+    python -m submitter.bench imports --max-ms 20
+"""
+
+import argparse
+import getpass
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from . import fake
+from .cli import parse_option
+from .submitter import Submitter, count_finished, ensure_dir
+
+
+def makespan (backend='npx4', n_jobs=100, duration=.1, slots=4,
+              latency=0., failure=0., eviction=0., evict_after=None,
+              max_jobs=None, seed=0, keep=False, **options):
+    """Time a sweep of `n_jobs` jobs of `duration` seconds on fake `slots`.
+
+    `latency`, `failure`, `eviction` and `evict_after` are passed on to the
+    fakes as $SUBMITTER_FAKE_<NAME>.  Extra keyword arguments are passed on
+    to the backend's submit method; the threads backend gets a `cpu_budget`
+    of `slots` unless given one.  The sweep is run in a temporary
+    directory, which is removed unless `keep` is True.
+
+    Returns a dict with the `makespan` and `ideal` time in seconds, the
+    `efficiency` and the number of `completed` jobs.
+    """
+    root = tempfile.mkdtemp (prefix='submitter_bench_')
+    home = ensure_dir (os.path.join (root, 'home'))
+    for filename in ('.bashrc_condor', '.bashrc_sge', 'sge_settings.sh'):
+        open (os.path.join (home, filename), 'w').close ()
+    env = fake.environment (
+        fake.install (os.path.join (root, 'bin')),
+        state=os.path.join (root, 'state'), slots=slots, latency=latency,
+        failure=failure, eviction=eviction, evict_after=evict_after,
+        seed=seed, remap='/scratch={0}'.format (os.path.join (root, 'scratch')))
+    env['HOME'] = home
+    env.setdefault ('USER', getpass.getuser ())
+    old_env = dict (os.environ)
+    os.environ.update (env)
+    try:
+        sub = Submitter (job_dir=os.path.join (root, 'jobs'),
+                         max_jobs=max_jobs)
+        sub.sge_settings = os.path.join (home, 'sge_settings.sh')
+        # through sh, since submit_threads runs commands without a shell
+        commands = ["sh -c 'sleep {0}; echo job {1}'".format (duration, i)
+                    for i in range (n_jobs)]
+        labels = ['job_{0:06d}'.format (i) for i in range (n_jobs)]
+        if backend == 'threads':
+            options.setdefault ('cpu_budget', slots)
+        start = time.time ()
+        getattr (sub, 'submit_' + backend) (commands, labels, **options)
+        fake.wait ()
+        elapsed = time.time () - start
+        completed = count_finished (root)
+    finally:
+        os.environ.clear ()
+        os.environ.update (old_env)
+        if keep:
+            print ('Kept {0}'.format (root), file=sys.stderr)
+        else:
+            shutil.rmtree (root)
+    width = min (slots, max_jobs or slots)
+    ideal = -(-n_jobs // width) * duration
+    return dict (makespan=elapsed, ideal=ideal, completed=completed,
+                 efficiency=ideal / elapsed if elapsed else 0.)
+
+
+#: statements timed by `import_times`
+IMPORT_STATEMENTS = (
+    'import submitter',
+    'from submitter import Submitter',
+    'import submitter.cli',
+)
+
+def import_time (statement, repeat=20):
+    """Time `statement` in `repeat` fresh interpreters.
+
+    A first, untimed run writes the bytecode cache, as an installed package
+    would have it.  Returns the median time in seconds and the sorted names
+    of the modules `statement` loaded.
+    """
+    import subprocess
+    code = ('import sys, time; t = time.time (); {0}; t = time.time () - t; '
+            'print (t); print (" ".join (sorted (sys.modules)))')
+    env = dict (os.environ)
+    env.pop ('PYTHONDONTWRITEBYTECODE', None)
+    package_dir = os.path.dirname (os.path.dirname (os.path.abspath (__file__)))
+    env['PYTHONPATH'] = os.pathsep.join (
+        filter (None, [package_dir, env.get ('PYTHONPATH')]))
+    def run (statement):
+        output = subprocess.check_output (
+            [sys.executable, '-c', code.format (statement)], env=env)
+        t, modules = output.decode ().splitlines ()
+        return float (t), set (modules.split ())
+    baseline = run ('pass')[1]
+    run (statement)
+    times = []
+    for i in range (repeat):
+        t, modules = run (statement)
+        times.append (t)
+    times.sort ()
+    return times[len (times) // 2], sorted (modules - baseline)
+
+def import_times (statements=IMPORT_STATEMENTS, repeat=20):
+    """Map each of `statements` to its `import_time`."""
+    return dict ((statement, import_time (statement, repeat))
+                 for statement in statements)
+
+
+def main (argv=None):
+    """Run the benchmark command line interface."""
+    parser = argparse.ArgumentParser (
+        prog='python -m submitter.bench',
+        description=__doc__.split ('\n')[0])
+    commands = parser.add_subparsers (dest='command')
+    p = commands.add_parser ('makespan',
+        help='time a sweep of sleep jobs through the fake schedulers')
+    p.add_argument ('--backend', default='npx4',
+        help='submit method to use, e.g. npx4 for Submitter.submit_npx4')
+    p.add_argument ('--jobs', type=int, default=100, dest='n_jobs')
+    p.add_argument ('--duration', type=float, default=.1,
+        help='seconds per job')
+    p.add_argument ('--slots', type=int, default=4)
+    p.add_argument ('--max-jobs', type=int)
+    p.add_argument ('--latency', type=float, default=0.,
+        help='seconds from submission until a job can start')
+    p.add_argument ('--failure', type=float, default=0.,
+        help='probability that a job fails without running')
+    p.add_argument ('--eviction', type=float, default=0.,
+        help='probability that a job is evicted once')
+    p.add_argument ('--evict-after', type=float,
+        help='seconds a job runs before its eviction')
+    p.add_argument ('--seed', type=int, default=0)
+    p.add_argument ('--keep', action='store_true',
+        help='keep the temporary job directory')
+    p.add_argument ('--min-efficiency', type=float,
+        help='exit with status 1 if the efficiency is lower than this')
+    p.add_argument ('-o', '--option', dest='options', action='append',
+        type=parse_option, default=[],
+        help='extra backend keyword argument as key=value, e.g. -o array=true')
+    p = commands.add_parser ('imports',
+        help='time importing the package in fresh interpreters')
+    p.add_argument ('statements', nargs='*', default=IMPORT_STATEMENTS,
+        help='import statements to time')
+    p.add_argument ('--repeat', type=int, default=20)
+    p.add_argument ('--max-ms', type=float,
+        help='exit with status 1 if an import takes longer than this')
+    p.add_argument ('--forbid', action='append', default=['numpy'],
+        help='exit with status 1 if an import loads this module')
+    args = parser.parse_args (argv)
+    if args.command == 'imports':
+        status = 0
+        for statement in args.statements:
+            t, modules = import_time (statement, args.repeat)
+            top = sorted (set (m.split ('.')[0] for m in modules))
+            print ('{0}: {1:.1f} ms, loads {2} modules ({3})'.format (
+                statement, 1e3 * t, len (modules), ', '.join (top)))
+            forbidden = [m for m in args.forbid if m in modules]
+            if forbidden:
+                print ('  forbidden: {0}'.format (', '.join (forbidden)))
+                status = 1
+            if args.max_ms is not None and 1e3 * t > args.max_ms:
+                status = 1
+        return status
+    elif args.command != 'makespan':
+        parser.print_help ()
+        return 2
+
+    kwargs = vars (args)
+    kwargs.pop ('command')
+    min_efficiency = kwargs.pop ('min_efficiency')
+    kwargs.update (kwargs.pop ('options'))
+    result = makespan (**kwargs)
+    print ('{0}: {1} jobs of {2} s on {3} slots: makespan {4:.2f} s '
+           '(ideal {5:.2f} s, {6:.0%} efficient), {7} completed'.format (
+               args.backend, args.n_jobs, args.duration, args.slots,
+               result['makespan'], result['ideal'], result['efficiency'],
+               result['completed']))
+    if min_efficiency is not None and result['efficiency'] < min_efficiency:
+        return 1
+    if result['completed'] < args.n_jobs and not args.failure:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit (main ())
@@ -0,0 +1,226 @@
+# cli.py
+
+
+from __future__ import print_function
+
+__doc__ = """Submit jobs described as JSON lines.
+
+Each input line is a JSON object with a "command" and optionally a "label",
+"memory" (GB), "ncpu" (or "cpus") and "reqs" (or "requirements").  Jobs are
+read one line at a time and handed to the chosen backend, e.g.::
+
+    generate_jobs | python -m submitter npx4 --job-dir sweep --max-jobs 500
+
+The Condor backends (condor00, npx4, illume) take per-job memory/ncpu/reqs
+directly.  For other backends, jobs with different resources are submitted as
+separate groups, each from its own subdirectory of the job directory.
+
+At most --chunk-size jobs (default: 10000) are held in memory: longer inputs
+are submitted every N lines, each chunk from its own chunk_NNNN
+subdirectory, while shorter ones go straight into the job directory.  The
+chunks share --max-jobs through a SubmitLimiter, so that it caps the whole
+sweep rather than each chunk; this needs a backend that consults the
+limiter.  --chunk-size 0 reads the whole input before submitting it.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from .submitter import SubmitLimiter, Submitter
+
+
+#: backends whose submit method accepts per-job `resources`
+RESOURCE_BACKENDS = ('condor00', 'npx4', 'illume')
+
+#: the most jobs held in memory by default
+DEFAULT_CHUNK_SIZE = 10000
+
+#: backends that keep to a `limiter` budget (cobol00 only with array=true)
+LIMITED_BACKENDS = ('condor00', 'npx4', 'illume', 'threads', 'slurm', 'cobol00')
+
+
+def parse_option (text):
+    """Parse a backend option given as key=value.
+
+    The value is parsed as JSON if possible, and kept as a string otherwise.
+    """
+    key, sep, value = text.partition ('=')
+    if not sep:
+        raise argparse.ArgumentTypeError (
+            'expected key=value, got {0!r}'.format (text))
+    try:
+        value = json.loads (value)
+    except ValueError:
+        pass
+    return key, value
+
+
+def parse_job (line, n):
+    """Parse the JSON job spec `line`, the `n`-th of the input (from 0).
+
+    Returns (command, label, resources), or raises ValueError naming the line.
+    """
+    try:
+        spec = json.loads (line)
+    except ValueError as e:
+        raise ValueError ('line {0}: {1}'.format (n + 1, e))
+    if isinstance (spec, str):
+        spec = dict (command=spec)
+    if not isinstance (spec, dict):
+        raise ValueError ('line {0}: expected a JSON object or string'.format (
+            n + 1))
+    if 'command' not in spec:
+        raise ValueError ('line {0}: missing "command"'.format (n + 1))
+    label = spec.get ('label', 'job_{0:07d}'.format (n))
+    resources = (
+        spec.get ('memory'),
+        spec.get ('ncpu', spec.get ('cpus')),
+        spec.get ('reqs', spec.get ('requirements')),
+    )
+    return spec['command'], str (label), resources
+
+def read_jobs (f):
+    """Yield (command, label, resources) for each JSON line in `f`."""
+    for n, line in enumerate (f):
+        line = line.strip ()
+        if line:
+            yield parse_job (line, n)
+
+
+def submit_groups (sub, backend, groups, options, job_dir):
+    """Submit each resource group with its own copy of `sub`.
+
+    The group None holds jobs with per-job resources for RESOURCE_BACKENDS.
+    """
+    import copy
+    import os
+    if None in groups:
+        commands, labels, resources = groups[None]
+        sub = copy.copy (sub)
+        sub.job_dir = job_dir
+        getattr (sub, 'submit_' + backend) (
+            commands, labels, resources=resources, **options)
+        return
+    for k, (resources, (commands, labels, _)) in enumerate (
+            sorted (groups.items (), key=lambda item: str (item[0]))):
+        memory, ncpu, reqs = resources
+        group_sub = copy.copy (sub)
+        if len (groups) > 1:
+            group_sub.job_dir = os.path.join (job_dir, 'group_{0:03d}'.format (k))
+        else:
+            group_sub.job_dir = job_dir
+        if memory is not None:
+            group_sub.memory = memory
+        if ncpu is not None:
+            group_sub.ncpu = ncpu
+        kwargs = dict (options)
+        if reqs is not None:
+            kwargs['reqs'] = reqs
+        getattr (group_sub, 'submit_' + backend) (commands, labels, **kwargs)
+
+
+def main (argv=None):
+    """Run the command line interface."""
+    import os
+    parser = argparse.ArgumentParser (
+        prog='python -m submitter',
+        description=__doc__.split ('\n')[0],
+        epilog='Job specs are read as JSON lines; see the module docstring.')
+    parser.add_argument ('backend',
+        help='submit method to use, e.g. npx4 for Submitter.submit_npx4')
+    parser.add_argument ('input', nargs='?', default='-',
+        help='file with one JSON job spec per line (default: stdin)')
+    parser.add_argument ('--job-dir', default='jobs/')
+    parser.add_argument ('--max-jobs', type=int)
+    parser.add_argument ('--memory', type=float, help='default memory in GB')
+    parser.add_argument ('--ncpu', type=int, help='default number of cpus')
+    parser.add_argument ('--delay', type=float, default=0)
+    parser.add_argument ('--config', default='.bashrc_condor')
+    parser.add_argument ('--dry', action='store_true')
+    parser.add_argument ('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+        help='submit every N jobs of longer inputs, each chunk from its own '
+             'subdirectory; with --max-jobs, later chunks wait for slots in '
+             'the shared cap (default: %(default)s; 0: never)')
+    parser.add_argument ('-o', '--option', dest='options', action='append',
+        type=parse_option, default=[],
+        help='extra backend keyword argument as key=value, e.g. -o array=true')
+    args = parser.parse_args (argv)
+
+    sub = Submitter (job_dir=args.job_dir, dry=args.dry,
+                     max_jobs=args.max_jobs, delay=args.delay,
+                     memory=args.memory, ncpu=args.ncpu, config=args.config)
+    if not hasattr (sub, 'submit_' + args.backend):
+        parser.error ('unknown backend: {0}'.format (args.backend))
+    options = dict (args.options)
+    limiter_filename = None
+
+    def share_max_jobs ():
+        """Make the chunks share --max-jobs through a private limiter."""
+        if not args.max_jobs or args.dry:
+            return None
+        if args.backend not in LIMITED_BACKENDS or (
+                args.backend == 'cobol00' and not options.get ('array')):
+            parser.error ('more than --chunk-size jobs with --max-jobs need a '
+                          'backend that uses a limiter: {0} (cobol00 with '
+                          '-o array=true)'.format (', '.join (LIMITED_BACKENDS)))
+        import tempfile
+        fd, filename = tempfile.mkstemp (prefix='submitter_cli_', suffix='.json')
+        os.close (fd)
+        os.remove (filename)
+        sub.limiter = SubmitLimiter (filename, max_running=args.max_jobs)
+        return filename
+
+    def chunk_dir (chunk):
+        return os.path.join (args.job_dir, 'chunk_{0:04d}'.format (chunk))
+
+    start = time.time ()
+    f = sys.stdin if args.input == '-' else open (args.input)
+    # a full chunk is held back until the next job shows whether it is the last
+    groups, full, n_jobs, n_chunk, chunk = {}, None, 0, 0, 0
+    for n, line in enumerate (f):
+        line = line.strip ()
+        if not line:
+            continue
+        try:
+            command, label, resources = parse_job (line, n)
+        except ValueError as e:
+            parser.error (str (e))
+        if full is not None:
+            if chunk == 0:
+                limiter_filename = share_max_jobs ()
+            submit_groups (sub, args.backend, full, options, chunk_dir (chunk))
+            full, chunk = None, chunk + 1
+        if args.backend in RESOURCE_BACKENDS:
+            commands, labels, per_job = groups.setdefault (None, ([], [], []))
+            memory, ncpu, reqs = resources
+            overrides = dict ((key, value) for (key, value) in (
+                ('memory', memory), ('ncpu', ncpu), ('reqs', reqs))
+                if value is not None)
+            per_job.append (overrides or None)
+        else:
+            commands, labels, _ = groups.setdefault (resources, ([], [], None))
+        commands.append (command)
+        labels.append (label)
+        n_jobs += 1
+        n_chunk += 1
+        if args.chunk_size and n_chunk == args.chunk_size:
+            full, groups, n_chunk = groups, {}, 0
+    if f is not sys.stdin:
+        f.close ()
+    groups = full or groups
+    if groups:
+        job_dir = chunk_dir (chunk) if chunk else args.job_dir
+        submit_groups (sub, args.backend, groups, options, job_dir)
+    if limiter_filename:
+        for filename in (limiter_filename, limiter_filename + '.lock'):
+            if os.path.exists (filename):
+                os.remove (filename)
+    elapsed = time.time () - start
+    print ('Generated {0} jobs in {1:.2f} s ({2:.0f} jobs/s).'.format (
+        n_jobs, elapsed, n_jobs / max (elapsed, 1e-9)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main ()
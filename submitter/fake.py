@@ -0,0 +1,664 @@
+# fake.py
+
+
+from __future__ import print_function
+
+__doc__ = """Local stand-ins for the cluster commands used by the submitter.
+
+The Condor, SGE, Slurm and OSG backends end in ssh, rsync, condor_submit_dag,
+qsub or sbatch calls.  This module emulates those commands on the local host,
+so that whole sweeps can be run and timed offline::
+
+    python -m submitter.fake install /tmp/fakebin
+    PATH=/tmp/fakebin:$PATH python my_sweep.py
+    python -m submitter.fake wait
+
+Jobs run in a fixed pool of local slots, shared by every fake submission that
+uses the same state directory.  Batch commands return at once and run their
+jobs in a detached process, like the real schedulers, and `wait` blocks until
+all of them are done.  Condor jobs write Condor-style user logs, so
+`condor_job_status` and `Submitter.monitor_stragglers` work on them.
+
+The fakes are configured with environment variables:
+
+    SUBMITTER_FAKE_STATE        state directory
+                                (default: /tmp/submitter_fake_<uid>)
+    SUBMITTER_FAKE_SLOTS        number of job slots (default: cpu count)
+    SUBMITTER_FAKE_LATENCY      seconds from submission until a job can start
+    SUBMITTER_FAKE_FAILURE      probability that a job fails without running
+    SUBMITTER_FAKE_EVICTION     probability that a job is evicted once
+    SUBMITTER_FAKE_EVICT_AFTER  seconds a job runs before its eviction
+                                (default: 1)
+    SUBMITTER_FAKE_SEED         seed for the failure and eviction draws
+    SUBMITTER_FAKE_REMAP        remote=local path prefixes, comma separated,
+                                applied to ssh commands and rsync targets
+    SUBMITTER_FAKE_WAIT         if set, batch commands block until done
+
+Evicted jobs get SIGTERM, then are restarted from scratch in a new slot.
+"""
+
+import errno
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+
+#: commands emulated by this module
+COMMANDS = ('condor_submit_dag', 'condor_submit', 'condor_rm',
+            'qsub', 'sbatch', 'ssh', 'rsync')
+
+#: sbatch options that take no value
+SBATCH_FLAGS = ('--exclusive', '--hold', '--parsable', '--requeue',
+                '--no-requeue', '--wait', '-H')
+
+_log_lock = threading.Lock ()
+
+
+def setting (name, default=None, type=float):
+    """The value of $SUBMITTER_FAKE_<name>, or `default`."""
+    value = os.environ.get ('SUBMITTER_FAKE_' + name)
+    if value in (None, ''):
+        return default
+    return type (value)
+
+def state_path (*names):
+    """A path in the fake state directory; its parent directory is created."""
+    root = os.environ.get ('SUBMITTER_FAKE_STATE') \
+            or '/tmp/submitter_fake_{0}'.format (os.getuid ())
+    path = os.path.join (root, *names)
+    try:
+        os.makedirs (os.path.dirname (path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return path
+
+def next_id ():
+    """Allocate a job id, unique within the state directory."""
+    import fcntl
+    with open (state_path ('ids'), 'a+') as f:
+        fcntl.flock (f, fcntl.LOCK_EX)
+        f.seek (0)
+        n = int (f.read () or 1000) + 1
+        f.seek (0)
+        f.truncate ()
+        f.write (str (n))
+    return n
+
+def remap (text):
+    """Apply $SUBMITTER_FAKE_REMAP to the paths in `text`."""
+    for pair in filter (None, os.environ.get (
+            'SUBMITTER_FAKE_REMAP', '').split (',')):
+        remote, _, local = pair.partition ('=')
+        text = re.sub (r'(?<![\w.-]){0}(?=/|\b|$)'.format (re.escape (remote)),
+                       local.replace ('\\', r'\\'), text)
+    return text
+
+def alive (pid):
+    """Whether process `pid` exists."""
+    try:
+        os.kill (pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+# job execution
+
+def log_event (filename, code, cluster, text, details=()):
+    """Append a Condor user log event to `filename` (if given)."""
+    if not filename:
+        return
+    with _log_lock:
+        with open (filename, 'a') as f:
+            print ('{0} ({1:03d}.000.000) {2} {3}'.format (
+                code, cluster, time.strftime ('%m/%d %H:%M:%S'), text), file=f)
+            for line in details:
+                print ('\t' + line, file=f)
+            print ('...', file=f)
+
+class Slot (object):
+
+    """One of the $SUBMITTER_FAKE_SLOTS local job slots, held by flock."""
+
+    def __init__ (self, poll_interval=.02):
+        import fcntl
+        n_slots = setting ('SLOTS', os.cpu_count () or 1, int)
+        while True:
+            for k in range (n_slots):
+                f = open (state_path ('slots', str (k)), 'a')
+                try:
+                    fcntl.flock (f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    f.close ()
+                    continue
+                self.index, self._file = k, f
+                self.host = 'fake-slot-{0}'.format (k)
+                return
+            time.sleep (poll_interval)
+
+    def release (self):
+        self._file.close ()
+
+def run_job (key, args, stdout, stderr, cwd=None, env=None, log=None,
+             cluster=None):
+    """Run one job in a fake slot and return its exit code.
+
+    `key` seeds the failure and eviction draws for the job.  If `log` is
+    given, Condor events for `cluster` are written to it.  Returns None if
+    the job was removed with condor_rm.
+    """
+    import signal
+    rng = random.Random ('{0}:{1}'.format (setting ('SEED', 0, int), key))
+    fail = rng.random () < setting ('FAILURE', 0.)
+    evict = rng.random () < setting ('EVICTION', 0.)
+    cluster = cluster or next_id ()
+    removed = state_path ('removed', str (cluster))
+    pid_filename = state_path ('jobs', str (cluster))
+    log_event (log, '000', cluster, 'Job submitted from host: <127.0.0.1>')
+    time.sleep (setting ('LATENCY', 0.))
+    while True:
+        if os.path.exists (removed):
+            log_event (log, '009', cluster, 'Job was aborted.')
+            return None
+        slot = Slot ()
+        try:
+            log_event (log, '001', cluster,
+                    'Job executing on host: <127.0.0.1:9618?alias={0}>'.format (
+                        slot.host))
+            if fail:
+                with open (stderr, 'w') as f:
+                    print ('fake: injected failure on {0}'.format (slot.host),
+                           file=f)
+                result = 1
+                break
+            with open (stdout, 'w') as out, open (stderr, 'w') as err:
+                proc = subprocess.Popen (args, stdout=out, stderr=err, cwd=cwd,
+                                         env=env, preexec_fn=os.setsid)
+            with open (pid_filename, 'w') as f:
+                f.write (str (proc.pid))
+            try:
+                if not evict:
+                    result = proc.wait ()
+                    break
+                try:
+                    result = proc.wait (setting ('EVICT_AFTER', 1.))
+                    break
+                except subprocess.TimeoutExpired:
+                    os.killpg (proc.pid, signal.SIGTERM)
+                    proc.wait ()
+                evict = False
+                if os.path.exists (removed):
+                    continue
+                log_event (log, '004', cluster, 'Job was evicted.',
+                           ['(0) Job was not checkpointed.'])
+            finally:
+                os.remove (pid_filename)
+        finally:
+            slot.release ()
+    if os.path.exists (removed):
+        log_event (log, '009', cluster, 'Job was aborted.')
+        return None
+    log_event (log, '005', cluster, 'Job terminated.',
+               ['(1) Normal termination (return value {0})'.format (result)])
+    return result
+
+def run_pool (jobs, max_jobs=None):
+    """Call each of `jobs` in a thread, at most `max_jobs` at once.
+
+    Returns their results, in order.
+    """
+    jobs = list (jobs)
+    results = [None] * len (jobs)
+    queue = list (reversed (list (enumerate (jobs))))
+    lock = threading.Lock ()
+    def work ():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                i, job = queue.pop ()
+            results[i] = job ()
+    n_threads = min (max_jobs or len (jobs), len (jobs), 512)
+    threads = [threading.Thread (target=work) for i in range (n_threads)]
+    for thread in threads:
+        thread.start ()
+    for thread in threads:
+        thread.join ()
+    return results
+
+
+# background batches
+
+def background (kind, payload):
+    """Run a batch `kind` with `payload`.
+
+    The batch runs in a detached process, unless $SUBMITTER_FAKE_WAIT is set.
+    """
+    import json
+    if os.environ.get ('SUBMITTER_FAKE_WAIT'):
+        return RUNNERS[kind] (payload)
+    batch = next_id ()
+    payload_filename = state_path ('batches', '{0}.json'.format (batch))
+    with open (payload_filename, 'w') as f:
+        json.dump (dict (kind=kind, payload=payload), f)
+    runner_filename = state_path ('runners', str (batch))
+    open (runner_filename, 'w').close ()
+    with open (os.devnull) as null, open (state_path ('fake.log'), 'a') as log:
+        proc = subprocess.Popen (
+            [sys.executable, '-m', 'submitter.fake', '_run', payload_filename],
+            stdin=null, stdout=log, stderr=log, close_fds=True,
+            preexec_fn=os.setsid)
+    with open (runner_filename, 'w') as f:
+        f.write (str (proc.pid))
+    return 0
+
+def run_batch (payload_filename):
+    """Run a batch written by `background`."""
+    import json
+    with open (payload_filename) as f:
+        batch = json.load (f)
+    runner_filename = state_path ('runners', os.path.basename (
+        payload_filename).split ('.')[0])
+    try:
+        return RUNNERS[batch['kind']] (batch['payload'])
+    finally:
+        os.remove (payload_filename)
+        os.remove (runner_filename)
+
+def wait (timeout=None, poll_interval=.1):
+    """Wait until no fake batch is running; return whether that happened."""
+    start = time.time ()
+    while True:
+        busy = False
+        for name in os.listdir (state_path ('runners', '')):
+            filename = state_path ('runners', name)
+            try:
+                with open (filename) as f:
+                    pid = f.read ()
+            except IOError:
+                continue
+            if pid and not alive (int (pid)):
+                os.remove (filename)
+            else:
+                busy = True
+        if not busy:
+            return True
+        if timeout is not None and time.time () - start > timeout:
+            return False
+        time.sleep (poll_interval)
+
+
+# condor
+
+def read_submit_file (filename, macros={}):
+    """The key = value settings of a Condor submit file, keys in lowercase."""
+    with open (filename) as f:
+        text = re.sub (r'\\\n', ' ', f.read ())
+    settings = {}
+    for line in text.splitlines ():
+        line = line.strip ()
+        if not line or line.startswith ('#') or '=' not in line:
+            continue
+        key, _, value = line.partition ('=')
+        value = re.sub (r'\$\((\w+)\)',
+                        lambda m: macros.get (m.group (1), m.group (0)),
+                        value.strip ())
+        settings[key.strip ().lower ()] = value
+    return settings
+
+def condor_job (key, settings, cwd, cluster=None):
+    """A callable running the Condor job described by `settings`."""
+    def path (name):
+        value = settings.get (name)
+        return value and os.path.join (cwd, value)
+    args = [path ('executable')] + shlex.split (
+            settings.get ('arguments', '').strip ('"'))
+    return lambda: run_job (key, args, path ('output') or os.devnull,
+                            path ('error') or os.devnull, cwd=cwd,
+                            log=path ('log'), cluster=cluster)
+
+def run_dag (payload):
+    """Run the nodes of a DAG, like DAGMan."""
+    dag_filename, cwd = payload['dag'], payload['cwd']
+    subs, macros, posts, max_jobs = {}, {}, {}, payload.get ('max_jobs')
+    with open (dag_filename) as f:
+        for line in f:
+            words = line.split (None, 2)
+            if len (words) < 2:
+                continue
+            if words[0] == 'JOB':
+                subs[words[1]] = words[2].split ()[0]
+            elif words[0] == 'VARS':
+                macros.setdefault (words[1], {}).update (
+                    re.findall (r'(\w+)\s*=\s*"([^"]*)"', words[2]))
+            elif words[0] == 'SCRIPT' and words[1] == 'POST':
+                node, _, script = words[2].partition (' ')
+                posts[node] = script.strip ()
+            elif words[0] == 'CONFIG' and not max_jobs:
+                config = read_submit_file (os.path.join (cwd, words[1]))
+                max_jobs = int (config.get ('dagman_max_jobs_submitted', 0))
+    lock_filename = dag_filename + '.lock'
+    open (lock_filename, 'w').close ()
+    out = open (dag_filename + '.dagman.out', 'a')
+    def pr (*args):
+        with _log_lock:
+            print (time.strftime ('%m/%d/%y %H:%M:%S'), *args, file=out)
+            out.flush ()
+    try:
+        nodes = sorted (subs)
+        def node_job (node):
+            settings = read_submit_file (
+                os.path.join (cwd, subs[node]), macros.get (node, {}))
+            job = condor_job (node, settings, cwd)
+            def run ():
+                result = job ()
+                if node in posts:
+                    # DAGMan passes -1 as $RETURN for removed jobs
+                    script = posts[node].replace (
+                        '$RETURN', str (-1 if result is None else result))
+                    result = subprocess.call (shlex.split (script), cwd=cwd)
+                pr ('Node {0} {1} (return value {2})'.format (
+                    node, 'succeeded' if result == 0 else 'failed', result))
+                return result
+            return run
+        pr ('Running {0} nodes, maxjobs {1}'.format (len (nodes), max_jobs))
+        results = run_pool ([node_job (node) for node in nodes], max_jobs)
+        n_failed = sum (1 for result in results if result != 0)
+        if n_failed:
+            pr ('{0} of {1} nodes failed'.format (n_failed, len (nodes)))
+        else:
+            pr ('All jobs Completed!')
+        return 1 if n_failed else 0
+    finally:
+        out.close ()
+        os.remove (lock_filename)
+
+def condor_submit_dag (args):
+    max_jobs, dag_filename = None, None
+    args = list (args)
+    while args:
+        arg = args.pop (0)
+        if arg == '-maxjobs':
+            max_jobs = int (args.pop (0))
+        elif arg in ('-config', '-maxidle', '-maxpre', '-maxpost', '-append',
+                     '-batch-name', '-notification', '-outfile_dir'):
+            args.pop (0)
+        elif not arg.startswith ('-'):
+            dag_filename = os.path.abspath (arg)
+    if not dag_filename or not os.path.exists (dag_filename):
+        print ('ERROR: no such DAG file: {0}'.format (dag_filename),
+               file=sys.stderr)
+        return 1
+    if os.path.exists (dag_filename + '.lock'):
+        print ('ERROR: {0}.lock exists; is the DAG already running?'.format (
+            dag_filename), file=sys.stderr)
+        return 1
+    print ('Submitting job(s).')
+    print ('1 job(s) submitted to cluster {0}.'.format (next_id ()))
+    return background ('dag', dict (
+        dag=dag_filename, cwd=os.getcwd (), max_jobs=max_jobs))
+
+def run_condor (payload):
+    return condor_job (payload['key'], payload['settings'], payload['cwd'],
+                       payload['cluster']) ()
+
+def condor_submit (args):
+    sub_filename = [arg for arg in args if not arg.startswith ('-')][-1]
+    cluster = next_id ()
+    print ('Submitting job(s).')
+    print ('1 job(s) submitted to cluster {0}.'.format (cluster))
+    return background ('condor', dict (
+        key=os.path.abspath (sub_filename), cwd=os.getcwd (), cluster=cluster,
+        settings=read_submit_file (sub_filename)))
+
+def condor_rm (args):
+    import signal
+    for arg in args:
+        if arg.startswith ('-'):
+            continue
+        cluster = arg.split ('.')[0]
+        open (state_path ('removed', cluster), 'w').close ()
+        try:
+            with open (state_path ('jobs', cluster)) as f:
+                os.killpg (int (f.read ()), signal.SIGTERM)
+        except (IOError, OSError, ValueError):
+            pass
+        print ('All jobs in cluster {0} have been marked for removal'.format (
+            cluster))
+    return 0
+
+
+# sge and slurm
+
+def parse_tasks (spec):
+    """Task ids and concurrency cap of an SGE -t or Slurm --array spec."""
+    spec, _, cap = spec.partition ('%')
+    tasks = []
+    for part in spec.split (','):
+        part, _, step = part.partition (':')
+        first, _, last = part.partition ('-')
+        tasks.extend (range (int (first), int (last or first) + 1,
+                             int (step or 1)))
+    return tasks, int (cap) if cap else None
+
+def run_tasks (payload):
+    """Run the tasks of an SGE or Slurm job."""
+    env = dict (os.environ)
+    env.update (payload['env'])
+    def task_job (task):
+        task_env = dict (env)
+        stdout, stderr = payload['stdout'], payload['stderr']
+        if task is not None:
+            task_env[payload['task_var']] = str (task)
+            stdout = stdout.replace ('%a', str (task)).replace ('{task}', str (task))
+            stderr = stderr.replace ('%a', str (task)).replace ('{task}', str (task))
+        # the arguments tell apart arrays of one script, e.g. Slurm offsets
+        key = '{0}:{1}:{2}'.format (
+            payload['script'], ' '.join (payload['args'][1:]), task)
+        return lambda: run_job (key,
+                                payload['args'], stdout, stderr,
+                                cwd=payload['cwd'], env=task_env)
+    for job_id in payload.get ('after', ()):
+        while not os.path.exists (state_path ('finished', job_id)):
+            time.sleep (.05)
+    tasks = payload['tasks'] or [None]
+    try:
+        results = run_pool ([task_job (task) for task in tasks],
+                            payload['max_tasks'])
+    finally:
+        if payload.get ('job_id'):
+            open (state_path ('finished', str (payload['job_id'])), 'w').close ()
+    return max (results)
+
+def qsub (args):
+    options, args = {}, list (args)
+    while args and args[0].startswith ('-'):
+        arg = args.pop (0)
+        options[arg] = True if arg in ('-cwd', '-V') else args.pop (0)
+    script_filename = os.path.abspath (args.pop (0))
+    with open (script_filename) as f:
+        for line in f:
+            if line.startswith ('#$'):
+                words = shlex.split (line[2:])
+                if words and words[0] not in options:
+                    options[words[0]] = words[1] if len (words) > 1 else True
+    job_id = next_id ()
+    name = options.get ('-N', os.path.basename (script_filename))
+    tasks, max_tasks = parse_tasks (options['-t']) if '-t' in options \
+            else ([], None)
+    if '-tc' in options:
+        max_tasks = int (options['-tc'])
+    cwd = os.getcwd () if '-cwd' in options else os.path.expanduser ('~')
+    def output (option, letter):
+        path = os.path.join (cwd, options.get (option, cwd))
+        if os.path.isdir (path):
+            path = os.path.join (path, '{0}.{1}{2}{3}'.format (
+                name, letter, job_id, '.{task}' if tasks else ''))
+        return path
+    if tasks:
+        print ('Your job-array {0}.{1}-{2}:1 ("{3}") has been submitted'.format (
+            job_id, tasks[0], tasks[-1], name))
+    else:
+        print ('Your job {0} ("{1}") has been submitted'.format (job_id, name))
+    return background ('tasks', dict (
+        script=script_filename, cwd=cwd,
+        args=[options.get ('-S', '/bin/sh'), script_filename] + args,
+        stdout=output ('-o', 'o'), stderr=output ('-e', 'e'),
+        tasks=tasks, max_tasks=max_tasks, task_var='SGE_TASK_ID',
+        env=dict (JOB_ID=str (job_id), JOB_NAME=name,
+                  SGE_TASK_ID='undefined', SGE_O_WORKDIR=os.getcwd ())))
+
+def sbatch (args):
+    options, args = {}, list (args)
+    def option (arg, args):
+        key, sep, value = arg.partition ('=')
+        if not sep:
+            value = True if key in SBATCH_FLAGS else args.pop (0)
+        options.setdefault (key, value)
+    while args and args[0].startswith ('-'):
+        option (args.pop (0), args)
+    script_filename = os.path.abspath (args.pop (0))
+    with open (script_filename) as f:
+        for line in f:
+            if line.startswith ('#SBATCH'):
+                words = shlex.split (line[7:])
+                while words:
+                    option (words.pop (0), words)
+    job_id = next_id ()
+    name = options.get ('--job-name', os.path.basename (script_filename))
+    tasks, max_tasks = parse_tasks (options['--array']) \
+            if '--array' in options else ([], None)
+    def output (option):
+        default = 'slurm-%A_%a.out' if tasks else 'slurm-%j.out'
+        path = options.get (option, options.get ('--output', default))
+        return os.path.abspath (path.replace ('%A', str (job_id))
+                                .replace ('%j', str (job_id))
+                                .replace ('%x', name))
+    after = []
+    for dependency in options.get ('--dependency', '').split (','):
+        kind, _, ids = dependency.partition (':')
+        if kind in ('after', 'afterany', 'afterok', 'afternotok'):
+            after.extend (ids.split (':'))
+        elif kind:
+            print ('fake sbatch: unsupported dependency: {0}'.format (
+                dependency), file=sys.stderr)
+            return 1
+    if '--parsable' in options:
+        print (job_id)
+    else:
+        print ('Submitted batch job {0}'.format (job_id))
+    return background ('tasks', dict (
+        script=script_filename, cwd=os.getcwd (), job_id=job_id, after=after,
+        args=[script_filename] + args,
+        stdout=output ('--output'), stderr=output ('--error'),
+        tasks=tasks, max_tasks=max_tasks, task_var='SLURM_ARRAY_TASK_ID',
+        env=dict (SLURM_JOB_ID=str (job_id), SLURM_ARRAY_JOB_ID=str (job_id),
+                  SLURM_JOB_NAME=name)))
+
+
+# remote access
+
+def ssh (args):
+    args = list (args)
+    while args and args[0].startswith ('-'):
+        arg = args.pop (0)
+        if len (arg) == 2 and arg[1] in 'bcDEeFIiJLlmOopQRSWw':
+            args.pop (0)
+    if len (args) < 2:
+        print ('fake ssh: a remote command is required', file=sys.stderr)
+        return 255
+    shell = os.environ.get ('SUBMITTER_FAKE_SHELL') or (
+        '/bin/bash' if os.path.exists ('/bin/bash') else '/bin/sh')
+    return subprocess.call ([shell, '-c', remap (' '.join (args[1:]))],
+                            cwd=os.path.expanduser ('~'))
+
+def rsync (args):
+    import shutil
+    paths = [arg for arg in args if not arg.startswith ('-')]
+    sources, dest = paths[:-1], paths[-1]
+    dest = remap (re.sub (r'^[^/:]*:', '', dest))
+    for source in sources:
+        source = re.sub (r'^[^/:]*:', '', source)
+        if source.endswith ('/'):
+            target = dest
+        else:
+            target = os.path.join (dest, os.path.basename (source))
+        if not os.path.isdir (source):
+            if not os.path.isdir (dest):
+                os.makedirs (dest)
+            shutil.copy2 (source, target)
+            continue
+        for dirpath, dirnames, filenames in os.walk (source):
+            target_dir = os.path.join (target, os.path.relpath (dirpath, source))
+            if not os.path.isdir (target_dir):
+                os.makedirs (target_dir)
+            for filename in filenames:
+                shutil.copy2 (os.path.join (dirpath, filename),
+                              os.path.join (target_dir, filename))
+    return 0
+
+
+# installation
+
+def install (bin_dir):
+    """Write executables for each of COMMANDS to `bin_dir`; return its path."""
+    bin_dir = os.path.abspath (bin_dir)
+    if not os.path.isdir (bin_dir):
+        os.makedirs (bin_dir)
+    package_dir = os.path.dirname (os.path.dirname (os.path.abspath (__file__)))
+    for command in COMMANDS:
+        filename = os.path.join (bin_dir, command)
+        with open (filename, 'w') as f:
+            print ('#!/bin/sh', file=f)
+            print ('PYTHONPATH={0}${{PYTHONPATH:+:$PYTHONPATH}} exec {1} '
+                   '-m submitter.fake {2} "$@"'.format (
+                       shlex.quote (package_dir), shlex.quote (sys.executable),
+                       command), file=f)
+        os.chmod (filename, 0o755)
+    return bin_dir
+
+def environment (bin_dir, **settings):
+    """A copy of os.environ set up to use the fakes in `bin_dir`.
+
+    Keyword arguments set $SUBMITTER_FAKE_<KEY>, e.g. ``slots=8``.
+    """
+    env = dict (os.environ)
+    env['PATH'] = bin_dir + os.pathsep + env.get ('PATH', '')
+    for key, value in settings.items ():
+        if value is not None:
+            env['SUBMITTER_FAKE_' + key.upper ()] = str (value)
+    return env
+
+
+RUNNERS = dict (dag=run_dag, condor=run_condor, tasks=run_tasks)
+
+def main (argv=None):
+    """Run a fake command: ``python -m submitter.fake COMMAND [ARGS...]``."""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print (__doc__)
+        print ('usage: python -m submitter.fake '
+               '{{install BIN_DIR|wait|{0}}} ...'.format ('|'.join (COMMANDS)))
+        return 0
+    command, args = argv[0], argv[1:]
+    if command == 'install':
+        print (install (args[0] if args else 'fakebin'))
+        return 0
+    elif command == 'wait':
+        return 0 if wait (float (args[0]) if args else None) else 1
+    elif command == '_run':
+        return run_batch (args[0]) or 0
+    elif command in COMMANDS:
+        return globals ()[command] (args) or 0
+    print ('unknown command: {0}'.format (command), file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit (main ())
@@ -5,26 +5,27 @@ from __future__ import print_function
 
 __doc__ = """Submit jobs processes."""
 
+import errno
 import os
 import re
-import socket
 import sys
-import subprocess
 import time
 
-import numpy as np
-
 
 
 class Submitter (object):
 
     """Submit jobs as processes."""
 
+    #: SGE environment script sourced on cobol00 before calling qsub
+    sge_settings = '/data/sge/current/icecube/common/settings.sh'
+
     def __init__ (self,
             job_dir='jobs/', 
             dry=False, max_jobs=None, delay=0, memory=None, ncpu=None, 
             config='.bashrc_condor',
-            logfile=sys.stderr):
+            logfile=sys.stderr,
+            registry=None, env_cache=None, limiter=None):
         """Construct a Submitter."""
         self.job_dir = job_dir
         self.dry = dry
@@ -33,6 +34,9 @@ class Submitter (object):
         self.ncpu = ncpu
         self.delay = delay
         self.config = config
+        self.registry = registry
+        self.env_cache = env_cache
+        self.limiter = limiter
     @property
     def dry (self):
         """Whether submit should do dry runs, not actually submit jobs."""
@@ -97,6 +101,256 @@ class Submitter (object):
     def config (self, filename):
         self._config = filename
 
+    @property
+    def env_cache (self):
+        """How jobs load the environment set up by `config`.
+
+        None: each job sources `config` (the default).
+        'submit': `config` is sourced once at submit time, and jobs restore
+            the resulting environment from a snapshot in `job_dir`.
+        'node': the first job on each execute node sources `config` and
+            saves the environment in /tmp, keyed by a hash of `config`; later
+            jobs on that node restore it from there.  The cache directory
+            must belong to the user, or jobs source `config` instead.
+
+        Only the exported variables that `config` changes are captured, not
+        shell functions or aliases, and variables it extends (such as PATH)
+        are extended again in each job (see :func:`env_capture_lines`).
+        """
+        return self._env_cache
+
+    @env_cache.setter
+    def env_cache (self, env_cache):
+        if env_cache not in (None, 'submit', 'node'):
+            raise ValueError (
+                "`env_cache` must be None, 'submit' or 'node'")
+        self._env_cache = env_cache
+
+    def config_lines (self, job_dir):
+        """Shell lines with which job scripts set up their environment."""
+        config_filename = '{0}/{1}'.format (os.getenv ('HOME'), self.config)
+        if not self.env_cache:
+            return ['. {0}'.format (config_filename)]
+        import hashlib
+        import subprocess
+        h = hashlib.sha1 (config_filename.encode ('utf-8'))
+        if os.path.exists (config_filename):
+            with open (config_filename, 'rb') as f:
+                h.update (f.read ())
+        env_name = 'env_{0}.sh'.format (h.hexdigest ()[:16])
+        capture = env_capture_lines (config_filename)
+        if self.env_cache == 'submit':
+            if not os.path.exists (config_filename):
+                raise RuntimeError ('{0} not found'.format (config_filename))
+            env_filename = os.path.join (job_dir, env_name)
+            if not os.path.exists (env_filename):
+                with open (env_filename + '.tmp', 'w') as f:
+                    if subprocess.call (['sh', '-c', '\n'.join (capture)],
+                                        stdout=f):
+                        raise RuntimeError (
+                            'could not capture the environment from {0}'.format (
+                                config_filename))
+                os.rename (env_filename + '.tmp', env_filename)
+            return ['. {0}'.format (env_filename)]
+        # only trust a cache directory this user owns and others cannot write
+        lines = [
+            'env_dir=/tmp/submitter_env_`id -u`',
+            'env_filename=$env_dir/{0}'.format (env_name),
+            'mkdir -p -m 700 $env_dir 2>/dev/null',
+            'if [ -d $env_dir ] && [ ! -L $env_dir ] && [ -O $env_dir ] \\',
+            '        && chmod 700 $env_dir; then',
+            '    if [ ! -s $env_filename ]; then',
+            '        (',
+            '            command -v flock >/dev/null && flock 9',
+            '            if [ ! -s $env_filename ]; then',
+            '                (',
+        ]
+        lines.extend ('                    ' + line for line in capture)
+        lines.extend ([
+            '                ) > $env_filename.$$ \\',
+            '                    && mv $env_filename.$$ $env_filename',
+            '            fi',
+            '        ) 9>$env_filename.lock',
+            '    fi',
+            'fi',
+            'if [ -O $env_dir ] && [ -s $env_filename ] && [ -O $env_filename ]; then',
+            '    . $env_filename',
+            'else',
+            '    . {0}'.format (config_filename),
+            'fi',
+        ])
+        return lines
+
+    @property
+    def registry (self):
+        """The :class:`JobRegistry` shared with other sweeps, or None.
+
+        If set, every submit method skips commands that another job directory
+        has already reserved or submitted, unless that job is known to have
+        failed, and links the other job directory into this one as
+        duplicate_<label>.  The other commands are reserved while they are
+        submitted, and registered once their submission has succeeded.  May
+        be set to True to use the default registry file, or to a filename.
+        """
+        return self._registry
+
+    @registry.setter
+    def registry (self, registry):
+        if registry is True:
+            registry = JobRegistry ()
+        elif isinstance (registry, str):
+            registry = JobRegistry (registry)
+        self._registry = registry
+
+    @property
+    def limiter (self):
+        """The :class:`SubmitLimiter` shared with other Submitters, or None.
+
+        If set, :meth:`submit_threads`, the Condor DAG backends on this host
+        (condor00, npx4, illume) and the array jobs of :meth:`submit_cobol00`
+        and :meth:`submit_slurm` stay within its global running-job budget,
+        and the DAGs also within its submission rate.  May be set to True to
+        use the default state file, or to a filename.
+        """
+        return self._limiter
+
+    @limiter.setter
+    def limiter (self, limiter):
+        if limiter is True:
+            limiter = SubmitLimiter ()
+        elif isinstance (limiter, str):
+            limiter = SubmitLimiter (limiter)
+        self._limiter = limiter
+
+    def claim_jobs (self, key, n_total, watch, done=None):
+        """Claim up to `max_jobs` of `n_total` slots of the `limiter` budget.
+
+        Blocks until at least one slot is free.  The claim lasts while the
+        file `watch` exists, or until `done` is written (see
+        :meth:`SubmitLimiter.acquire`).  Returns the number of slots granted.
+        """
+        n = min (self.max_jobs or n_total, n_total)
+        max_jobs = self.limiter.acquire (key, n, watch=watch, done=done,
+                                         block=False)
+        if not max_jobs:
+            self.log ('Waiting for the host-wide job budget to free up...')
+            max_jobs = self.limiter.acquire (key, n, watch=watch, done=done)
+        return max_jobs
+
+    def limit_dag (self, dag_filename, n_total, spr_dag_config,
+            max_per_interval=None):
+        """Claim a share of the `limiter` budget for a DAG.
+
+        Blocks until at least one job slot is free, and returns the -maxjobs
+        value to use (or `max_jobs` without a limiter).  Writes
+        `max_per_interval` to the DAG's config, or the DAG's share of the
+        submission rate if that is lower.
+        """
+        max_jobs = self.max_jobs
+        if self.limiter and not self.dry:
+            max_jobs = self.claim_jobs (
+                    dag_filename, n_total, dag_filename + '.lock',
+                    done=dag_filename + '.dagman.out')
+            share = self.limiter.dag_submits_per_interval ()
+            if share:
+                max_per_interval = min (max_per_interval or share, share)
+        if max_per_interval:
+            spr_dag_config ('DAGMAN_MAX_SUBMITS_PER_INTERVAL =',
+                            max_per_interval)
+        return max_jobs
+
+    def limit_array (self, script_filename, n_total):
+        """Claim a share of the `limiter` budget for an array job.
+
+        The claim lasts while <script>.running exists; the array's tasks
+        remove it once all `n_total` have run (see :func:`array_done_lines`).
+        Returns the concurrency cap to use (or `max_jobs` without a limiter).
+        """
+        if not self.limiter or self.dry:
+            return self.max_jobs
+        watch = script_filename + '.running'
+        open (watch, 'w').close ()
+        if os.path.exists (script_filename + '.done'):
+            os.remove (script_filename + '.done')
+        return self.claim_jobs (script_filename, n_total, watch)
+
+    def release_jobs (self, key):
+        """Give back the budget claimed for `key` if its submission failed."""
+        if self.limiter and not self.dry:
+            self.limiter.release (key)
+            if os.path.exists (key + '.running'):
+                os.remove (key + '.running')
+
+    def job_resources (self, resources, label, **defaults):
+        """The resources of the job `label`, for the Condor submit methods.
+
+        `resources`: None, or a dict mapping labels to None or to a dict of
+            overrides.
+        `defaults`: the submit call's reqs, blacklist and gpus.
+
+        Returns a dict with keys memory, ncpu, reqs, gpus and blacklist.
+        """
+        res = dict (memory=self.memory, ncpu=self.ncpu,
+                    reqs=None, gpus=None, blacklist=())
+        res.update (defaults)
+        overrides = resources and resources.get (label)
+        if overrides:
+            unknown = set (overrides) - set (res)
+            if unknown:
+                raise ValueError ('unknown resources for {0}: {1}'.format (
+                    label, ', '.join (sorted (unknown))))
+            res.update (overrides)
+        res['blacklist'] = tuple (res['blacklist'] or ())
+        return res
+
+    def deduplicate (self, commands, command_labels):
+        """Drop commands already submitted from other job directories.
+
+        The remaining commands are reserved in the registry, so that
+        overlapping sweeps skip them, until :meth:`register` records their
+        submission or drops the reservation.  Without a registry, the inputs
+        are returned as is.
+        """
+        if self.registry is None:
+            return commands, command_labels
+        job_dir = os.path.realpath (ensure_dir (self.job_dir))
+        if self.dry:
+            duplicates = self.registry.duplicates (
+                    commands, command_labels, job_dir)
+        else:
+            duplicates = self.registry.reserve (
+                    commands, command_labels, job_dir)
+        if not duplicates:
+            return commands, command_labels
+        kept_commands, kept_labels = [], []
+        for command, label in zip (commands, command_labels):
+            if label not in duplicates:
+                kept_commands.append (command)
+                kept_labels.append (label)
+                continue
+            entry = duplicates[label]
+            self.log ('Skipping {0}: already submitted as {1} from {2}'.format (
+                label, entry['label'], entry['job_dir']))
+            link = os.path.join (job_dir, 'duplicate_{0}'.format (label))
+            if not self.dry and not os.path.lexists (link):
+                os.symlink (entry['job_dir'], link)
+        return kept_commands, kept_labels
+
+    def register (self, commands, command_labels, status=0):
+        """Record `commands` as submitted from `job_dir`.
+
+        `status` is that of the submit command, as returned by os.system; if
+        it is not 0, the reservations made by :meth:`deduplicate` are dropped
+        instead.  Does nothing in dry mode, or without a registry.
+        """
+        if self.registry is None or self.dry:
+            return
+        job_dir = os.path.realpath (self.job_dir)
+        if status:
+            self.registry.release (commands, job_dir)
+        else:
+            self.registry.register (commands, command_labels, job_dir)
+
     def announce_command (self, cmd):
         if self.dry:
             self.log ('***** Would execute command:')
@@ -105,26 +359,108 @@ class Submitter (object):
 
     def submit_serial (self, commands, command_labels):
         """Submit jobs sequentially."""
-        for command in commands:
+        commands, command_labels = self.deduplicate (commands, command_labels)
+        for command, label in zip (commands, command_labels):
             self.announce_command (command)
             if not self.dry:
-                os.system (command)
-
-    def submit_threads (self, commands, command_labels):
-        """Submit jobs in parallel on the current host."""
+                self.register ([command], [label], os.system (command))
+
+    def submit_threads (self, commands, command_labels,
+            cpu_budget=None, memory_budget=None, pin_cpus=False):
+        """Submit jobs in parallel on the current host.
+
+        Besides `max_jobs`, jobs are admitted against a CPU and a memory
+        budget.  Each job is assumed to use `ncpu` cores (default: 1) and
+        `memory` GB (default: no memory accounting).  A job is held back
+        while the cores claimed by running jobs plus the threads other
+        processes are running right now (procs_running in /proc/loadavg)
+        would exceed `cpu_budget`, or while the memory claimed by running
+        jobs would exceed `memory_budget` or MemAvailable (from
+        /proc/meminfo) drops below `memory`.  One job is always allowed to
+        run, even if it does not fit the budget on its own.
+
+        `commands`: a sequence of commands.
+        `command_labels`: a sequence of command labels.
+        `cpu_budget`: the number of cores to fill (default: the number of
+            cores this process may run on).
+        `memory_budget`: the memory in GB to fill (default: MemAvailable at
+            submission time).
+        `pin_cpus`: if True, pin each job to its own set of `ncpu` cores.
+            Then `cpu_budget` and `ncpu` must not exceed the available cores.
+
+        If a `limiter` is set, each job also takes a slot from its host-wide
+        running-job budget and a token from its submission rate.
+        """
         ensure_dir (self.job_dir)
+        commands, command_labels = self.deduplicate (commands, command_labels)
         import shlex
         import subprocess
         procs = []
-        def n_running ():
-            polls = [proc.poll() for proc in procs]
-            returncodes = [proc.returncode for proc in procs]
-            running = [returncode is None for returncode in returncodes]
-            return np.sum (running)
+        cores = available_cores ()
+        free_cores = list (cores)
+        job_ncpu = int (self.ncpu or 1)
+        job_memory = self.memory or 0
+        if cpu_budget is None:
+            cpu_budget = len (cores)
+        if pin_cpus and max (cpu_budget, job_ncpu) > len (cores):
+            raise ValueError (
+                'cannot pin jobs to {0} cores with only {1} available'.format (
+                    max (cpu_budget, job_ncpu), len (cores)))
+        if memory_budget is None and job_memory:
+            memory_budget = available_memory ()
+        claims = {}
 
-        def too_many ():
-            return self.max_jobs \
-                    and n_running () >= self.max_jobs
+        def n_running ():
+            for proc, proc_cores, stdout in procs:
+                if proc.poll () is not None and proc_cores:
+                    free_cores.extend (proc_cores)
+                    del proc_cores[:]
+                if proc.returncode is not None and proc.pid in claims:
+                    self.limiter.release (claims.pop (proc.pid))
+                if proc.returncode is not None and not stdout.closed:
+                    # mark the output finished, as the batch wrappers do
+                    stdout.write ('End: {0}.\n'.format (
+                        time.strftime ('%a %b %d %H:%M:%S %Z %Y')))
+                    stdout.close ()
+            running = [proc.returncode is None
+                       for (proc, proc_cores, stdout) in procs]
+            return sum (running)
+
+        def too_many (label):
+            # returns whether the job must wait, and its limiter key if not
+            if local_too_many ():
+                return True, None
+            if self.limiter:
+                key = 'threads:{0}:{1}'.format (os.getpid (), label)
+                if not self.limiter.acquire (key, pid=os.getpid (),
+                                             block=False, rate_limited=True):
+                    return True, None
+                return False, key
+            return False, None
+
+        def local_too_many ():
+            n = n_running ()
+            if n == 0:
+                return False
+            if self.max_jobs and n >= self.max_jobs:
+                return True
+            claimed_cpu = n * job_ncpu
+            running = running_threads ()
+            foreign_load = max (0, running - claimed_cpu) if running else 0
+            if claimed_cpu + foreign_load + job_ncpu > cpu_budget:
+                return True
+            if job_memory:
+                if memory_budget and (n + 1) * job_memory > memory_budget:
+                    return True
+                free_memory = available_memory ()
+                if free_memory is not None and free_memory < job_memory:
+                    return True
+            return False
+
+        def claim_cores ():
+            claimed = free_cores[:job_ncpu]
+            del free_cores[:job_ncpu]
+            return claimed
 
         n_total = len (commands)
         length = len (str (n_total))
@@ -139,19 +475,36 @@ class Submitter (object):
             args = shlex.split (command)
             self.announce_command (command)
             if not self.dry:
-                if too_many ():
+                waiting, key = too_many (label)
+                if waiting:
                     s = Spinner ()
                     self.log ('waiting for available thread... ', end='')
                     s.start ()
                     time.sleep (2)
-                    while too_many ():
+                    waiting, key = too_many (label)
+                    while waiting:
                         time.sleep (2)
                         s.next ()
+                        waiting, key = too_many (label)
                     s.finish ()
                     self.log ('submitting now.')
                     self.log ()
-                proc = subprocess.Popen (args, stdout=stdout, stderr=stderr)
-                procs.append (proc)
+                proc_cores = claim_cores () if pin_cpus else []
+                if proc_cores:
+                    preexec_fn = lambda: os.sched_setaffinity (0, proc_cores)
+                else:
+                    preexec_fn = None
+                try:
+                    proc = subprocess.Popen (args, stdout=stdout,
+                            stderr=stderr, preexec_fn=preexec_fn)
+                except OSError:
+                    if key:
+                        self.limiter.release (key)
+                    raise
+                procs.append ((proc, proc_cores, stdout))
+                self.register ([command], [label])
+                if key:
+                    claims[proc.pid] = key
                 if self.delay:
                     time.sleep (self.delay)
 
@@ -164,16 +517,26 @@ class Submitter (object):
         s.finish ()
         self.log ('threads finished.')
 
-    def submit_cobol00 (self, commands, command_labels, username=None):
+    def submit_cobol00 (self, commands, command_labels, username=None,
+            array=False):
         """Submit jobs in parallel on the cobol00 SGE cluster.
 
         This method logs into pa-pub, then into cobol00.  There, it executes
         the given command(s) on the cluster with qsub.
 
+        With `array`, all jobs are submitted as a single SGE array job with
+        one qsub call.  The commands and labels are written one per line to
+        cobol00_commands.txt and cobol00_labels.txt, and each task looks up
+        its own by $SGE_TASK_ID.  `max_jobs` becomes the array's concurrency
+        cap (qsub -tc) and `delay` is not used.  With a `limiter`, the cap is
+        the array's share of its budget instead.
+
         `commands`: a sequence of commands, or a single command.
         `command_labels`: a sequence of command labels, or a single one.
         `username`: the username in use on cobol00.
+        `array`: if True, submit one array job rather than one job per command.
         """
+        import socket
         if len (commands) == 0:
             print ('warning: no jobs')
             return
@@ -182,6 +545,10 @@ class Submitter (object):
             commands = [commands]
         if isinstance (command_labels, str):
             command_labels = [command_labels]
+        commands, command_labels = self.deduplicate (commands, command_labels)
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
         n_total = len (commands)
         length = len (str (n_total))
 
@@ -191,22 +558,29 @@ class Submitter (object):
         def spr (*args, **kwargs):
             print (*args, file=subscript, **kwargs)
 
-        spr ('. /data/sge/current/icecube/common/settings.sh')
+        spr ('. {0}'.format (self.sge_settings))
         os.system ('touch {0}/placeholder.o {0}/placeholder.queue'.format (
             job_dir))
         print ('Submitting jobs from {0} ...'.format (job_dir))
-        for n, (command, label) in enumerate (zip (commands, command_labels)):
-            script_filename = os.path.join (
-                    job_dir, 'cobol00_{0}.sh'.format (label))
+        user_str = username + '@' if username else ''
+        if array:
+            commands_filename = os.path.join (job_dir, 'cobol00_commands.txt')
+            labels_filename = os.path.join (job_dir, 'cobol00_labels.txt')
+            write_command_table (commands_filename, commands)
+            write_command_table (labels_filename, command_labels)
+            script_filename = os.path.join (job_dir, 'cobol00_array.sh')
             qsub_command = 'qsub -q all.q -e {0} -o {0} {1}'.format (
-                    os.path.realpath (job_dir),
-                    os.path.realpath (script_filename))
+                    job_dir, script_filename)
+            max_jobs = self.limit_array (script_filename, n_total)
             with open (script_filename, 'w') as script:
                 def pr (*args, **kwargs):
                     print (*args, file=script, **kwargs)
 
                 pr ('#!/bin/sh')
                 pr ('#$ -S /bin/sh')
+                pr ('#$ -t 1-{0}'.format (n_total))
+                if max_jobs:
+                    pr ('#$ -tc {0}'.format (max_jobs))
                 pr ()
                 pr ('# {0}'.format (qsub_command))
                 if self.memory:
@@ -214,38 +588,95 @@ class Submitter (object):
                 pr ()
                 pr ('. $HOME/.bashrc_sge')
                 pr ()
+                pr ('label=`sed -n "${{SGE_TASK_ID}}p" {0}`'.format (
+                    labels_filename))
+                pr ('command=`sed -n "${{SGE_TASK_ID}}p" {0}`'.format (
+                    commands_filename))
+                pr ()
                 pr ('hostname')
+                pr ('echo Label: $label')
+                pr ()
+                if self.limiter:
+                    done_lines = array_done_lines (
+                            script_filename, '$SGE_TASK_ID', n_total)
+                else:
+                    done_lines = []
+                for line in term_trap_lines (done_lines):
+                    pr (line)
                 pr ()
                 pr ('before=`date +%s`')
                 pr ('echo Begin: `date`.')
                 pr ('echo')
                 pr ()
-                pr (command)
+                pr ('eval "$command"')
                 pr ('result=$?')
                 pr ()
                 pr ('echo')
                 pr ('after=`date +%s`')
                 pr ('echo End: `date`.')
                 pr ()
+                if done_lines:
+                    for line in done_lines:
+                        pr (line)
+                    pr ()
                 pr ('exit $result')
 
             os.chmod (script_filename, 0o775)
-            user_str = username + '@' if username else ''
-            q_note_command = 'touch {0}.queue'.format (script_filename)
-            spr (q_note_command)
-            if self.max_jobs and n >= 1:
-                # wait_cmd = 'while test `qstat|grep {0}|wc -l` -ge {1}'.format (
-                #         username, self.max_jobs) \
-                #             + '; do sleep 10; done'
-                wait_cmd = "while test " \
-                    "$(expr `ls {0}/*.queue | wc -l` " \
-                    "- `tail -n1 {0}/*.o* | grep '^End: ' | wc -l`) " \
-                    "-ge {1}".format (job_dir, self.max_jobs + 2) \
-                            + '; do sleep 10; done'
-                spr (wait_cmd)
             spr (qsub_command)
-            if self.delay:
-                spr ('sleep {0:.0f}'.format (self.delay))
+        else:
+            for n, (command, label) in enumerate (zip (commands, command_labels)):
+                script_filename = os.path.join (
+                        job_dir, 'cobol00_{0}.sh'.format (label))
+                qsub_command = 'qsub -q all.q -e {0} -o {0} {1}'.format (
+                        os.path.realpath (job_dir),
+                        os.path.realpath (script_filename))
+                with open (script_filename, 'w') as script:
+                    def pr (*args, **kwargs):
+                        print (*args, file=script, **kwargs)
+
+                    pr ('#!/bin/sh')
+                    pr ('#$ -S /bin/sh')
+                    pr ()
+                    pr ('# {0}'.format (qsub_command))
+                    if self.memory:
+                        pr ('#$ -l h_vmem={0:.2f}G'.format (self.memory))
+                    pr ()
+                    pr ('. $HOME/.bashrc_sge')
+                    pr ()
+                    pr ('hostname')
+                    pr ()
+                    for line in term_trap_lines ():
+                        pr (line)
+                    pr ()
+                    pr ('before=`date +%s`')
+                    pr ('echo Begin: `date`.')
+                    pr ('echo')
+                    pr ()
+                    pr (command)
+                    pr ('result=$?')
+                    pr ()
+                    pr ('echo')
+                    pr ('after=`date +%s`')
+                    pr ('echo End: `date`.')
+                    pr ()
+                    pr ('exit $result')
+
+                os.chmod (script_filename, 0o775)
+                q_note_command = 'touch {0}.queue'.format (script_filename)
+                spr (q_note_command)
+                if self.max_jobs and n >= 1:
+                    # wait_cmd = 'while test `qstat|grep {0}|wc -l` -ge {1}'.format (
+                    #         username, self.max_jobs) \
+                    #             + '; do sleep 10; done'
+                    wait_cmd = "while test " \
+                        "$(expr `ls {0}/*.queue | wc -l` " \
+                        "- `tail -n1 {0}/*.o* | grep '^End: ' | wc -l`) " \
+                        "-ge {1}".format (job_dir, self.max_jobs + 2) \
+                                + '; do sleep 10; done'
+                    spr (wait_cmd)
+                spr (qsub_command)
+                if self.delay:
+                    spr ('sleep {0:.0f}'.format (self.delay))
         subscript.close ()
         hostname = socket.gethostname ()
         subscript_path = os.path.realpath (subscript_filename)
@@ -257,7 +688,10 @@ class Submitter (object):
                             user_str, subscript_path)
 
         if not self.dry:
-            os.system (qsub_command)
+            status = os.system (qsub_command)
+            if status and array:
+                self.release_jobs (script_filename)
+            self.register (commands, command_labels, status)
         else:
             self.log (qsub_command)
 
@@ -266,6 +700,7 @@ class Submitter (object):
             blacklist=[],
             reqs=None,
             max_per_interval=None,
+            resources=None,
             ):
         """Submit jobs in parallel on the condor00 Condor cluster.
 
@@ -276,7 +711,12 @@ class Submitter (object):
         `command_labels`: a sequence of command labels, or a single one.
         `username`: the username in use on condor00.
         `blacklist`: a list of hosts to avoid
+        `resources`: per-job overrides, a sequence parallel to `commands`
+            of None or dicts with any of the keys memory, ncpu, reqs, gpus
+            and blacklist.  Jobs with identical resources share one submit
+            description.
         """
+        import socket
         if len (commands) == 0:
             print ('warning: no jobs')
             return
@@ -289,6 +729,12 @@ class Submitter (object):
             commands = [commands]
         if isinstance (command_labels, str):
             command_labels = [command_labels]
+        if resources is not None:
+            resources = dict (zip (command_labels, resources))
+        commands, command_labels = self.deduplicate (commands, command_labels)
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
         n_total = len (commands)
         length = len (str (n_total))
 
@@ -305,17 +751,13 @@ class Submitter (object):
         def spr_dag_config (*args, **kwargs):
             print (*args, file=subdag_config, **kwargs)
 
+        config_lines = self.config_lines (job_dir)
         spr_dag ('CONFIG {0}'.format (subdag_config_filename))
-        if max_per_interval:
-            spr_dag_config (
-                    'DAGMAN_MAX_SUBMITS_PER_INTERVAL =',
-                    max_per_interval)
 
+        post_filename = write_post_script (log_dir)
+        descriptions = {}
         for n, (command, label) in enumerate (zip (commands, command_labels)):
-            dag_label = 'npx4_{0}.sh'.format (label)
-            dag_label = re.sub (r'\.', '_dot_', dag_label)
-            dag_label = re.sub (r'\+', '_plus_', dag_label)
-            dag_label = re.sub (r'-', '_minus_', dag_label)
+            dag_label = condor_dag_label (label)
             script_filename = os.path.realpath (os.path.join (
                     log_dir, dag_label))
             #script_filename = os.path.realpath (os.path.join (
@@ -329,7 +771,8 @@ class Submitter (object):
                 pr ()
                 pr ('')
                 pr ()
-                pr ('. {0}/{1}'.format (os.getenv ('HOME'), self.config))
+                for line in config_lines:
+                    pr (line)
                 pr ()
                 pr ('hostname')
                 pr ()
@@ -348,55 +791,67 @@ class Submitter (object):
 
             os.chmod (script_filename, 0o775)
 
-            tosubsub_filename = script_filename + '.sub'
-            with open (tosubsub_filename, 'w') as tosubsub:
-                def pr (*args, **kwargs):
-                    print (*args, file=tosubsub, **kwargs)
-
-                pr ('Universe       = vanilla')
-                pr ('Executable     = {0}'.format (script_filename))
-                pr ('Log            = {}/{}.log'.format (log_dir, dag_label))
-                pr ('Output         = {}/{}.out'.format (log_dir, dag_label))
-                pr ('Error          = {}/{}.err'.format (log_dir, dag_label))
-                pr ('Notification   = NEVER')
-                if blacklist:
-                    reqs_bl = ' && '.join (
-                            ['(Machine != "{0}")'.format (host)
-                                for host in blacklist])
-                    if reqs:
-                        pr('Requirements = {} && {}'.format(reqs, reqs_bl))
-                    else:    
-                        pr('Requirements = {}'.format(reqs_bl))
-                else:
-                    if reqs:
-                        pr('Requirements = {}'.format(reqs))
-                if self.memory:
-                    pr ('request_memory = {0:.2f}G'.format (self.memory))
-                if self.ncpu:
-                    pr ('request_cpus = {0:.0f}'.format (self.ncpu))
-                pr ('Queue')
+            res = self.job_resources (resources, label,
+                    reqs=reqs, blacklist=blacklist)
+            key = tuple (sorted (res.items ()))
+            if key not in descriptions:
+                tosubsub_filename = os.path.join (
+                        log_dir, 'condor00_{0:03d}.sub'.format (len (descriptions)))
+                descriptions[key] = tosubsub_filename
+                with open (tosubsub_filename, 'w') as tosubsub:
+                    def pr (*args, **kwargs):
+                        print (*args, file=tosubsub, **kwargs)
+
+                    pr ('Universe       = vanilla')
+                    pr ('Executable     = $(script)')
+                    pr ('Log            = $(script).log')
+                    pr ('Output         = $(script).out')
+                    pr ('Error          = $(script).err')
+                    pr ('Notification   = NEVER')
+                    if res['blacklist']:
+                        reqs_bl = ' && '.join (
+                                ['(Machine != "{0}")'.format (host)
+                                    for host in res['blacklist']])
+                        if res['reqs']:
+                            pr('Requirements = {} && {}'.format(res['reqs'], reqs_bl))
+                        else:    
+                            pr('Requirements = {}'.format(reqs_bl))
+                    else:
+                        if res['reqs']:
+                            pr('Requirements = {}'.format(res['reqs']))
+                    if res['gpus']:
+                        pr ('request_gpus = {0:.0f}'.format (res['gpus']))
+                    if res['memory']:
+                        pr ('request_memory = {0:.2f}G'.format (res['memory']))
+                    if res['ncpu']:
+                        pr ('request_cpus = {0:.0f}'.format (res['ncpu']))
+                    pr ('Queue')
 
             user_str = username + '@' if username else ''
-            dag_command = 'JOB {0} {1}'.format (
-                os.path.basename (script_filename), tosubsub_filename)
-            spr_dag (dag_command)
+            dag_node = os.path.basename (script_filename)
+            spr_dag ('JOB {0} {1}'.format (dag_node, descriptions[key]))
+            spr_dag ('VARS {0} script="{1}"'.format (dag_node, script_filename))
+            spr_dag ('SCRIPT POST {0} {1} {2} $RETURN'.format (
+                dag_node, post_filename, script_filename))
 
         subdag.close ()
+        max_jobs = self.limit_dag (subdag_filename, n_total, spr_dag_config,
+                                   max_per_interval)
         subdag_config.close ()
         hostname = socket.gethostname ()
 
         if 'condor' in hostname:
-            if self.max_jobs:
+            if max_jobs:
                 condor00_command = 'condor_submit_dag -maxjobs {0} {1}'.format (
-                    self.max_jobs, os.path.realpath (subdag_filename))
+                    max_jobs, os.path.realpath (subdag_filename))
             else:
                 condor00_command = 'condor_submit_dag {0}'.format (
                     os.path.realpath (subdag_filename))
         else:
-            if self.max_jobs:
+            if max_jobs:
                 condor00_command = 'ssh {0}pa-pub.umd.edu "ssh condor00 ' \
                         '\'condor_submit_dag -maxjobs {1} {2}\' "'.format (
-                            user_str, self.max_jobs, self.max_jobs,
+                            user_str, max_jobs,
                             os.path.realpath (subdag_filename))
             else:
                 condor00_command = 'ssh {0}pa-pub.umd.edu "ssh condor00 ' \
@@ -405,14 +860,18 @@ class Submitter (object):
                             os.path.realpath (subdag_filename))
         if not self.dry:
             print ('Submitting {} jobs\nfrom {} .'.format (n_total, job_dir))
-            os.system (condor00_command)
+            status = os.system (condor00_command)
+            if status:
+                self.release_jobs (subdag_filename)
+            self.register (commands, command_labels, status)
         else:
             print ('Prepared {} jobs\n in {} .'.format (n_total, job_dir))
             self.log (condor00_command)
 
     def submit_npx4 (self, commands, command_labels,
                      username=None, reqs=None,
-                     blacklist=[], gpus = None):
+                     blacklist=[], gpus = None, checkpoint=False,
+                     resources=None):
         """Submit jobs in parallel on the npx4 Condor cluster.
 
         This method logs into pub.icecube.wisc.edu, then into npx4.  There, it
@@ -421,7 +880,21 @@ class Submitter (object):
         `commands`: a sequence of commands, or a single command.
         `command_labels`: a sequence of command labels, or a single one.
         `username`: the username in use on npx4.
+        `checkpoint`: if True, the wrapper forwards SIGTERM to the command
+            and passes it a checkpoint directory as
+            $SUBMITTER_CHECKPOINT_DIR, so a job restarted after eviction can
+            resume from the state it saved there.  The directory is
+            <script>.checkpoint on the shared filesystem, except when
+            submitting from submit-1, where files are transferred: then it
+            is checkpoint in the job's sandbox, which
+            Condor transfers back on eviction and to <script>.checkpoint on
+            exit.
+        `resources`: per-job overrides, a sequence parallel to `commands`
+            of None or dicts with any of the keys memory, ncpu, reqs, gpus
+            and blacklist.  Jobs with identical resources share one submit
+            description.
         """
+        import socket
         if len (set (command_labels)) != len (command_labels):
             raise ValueError (
                 '`command_labels` must not include duplicate labels')
@@ -431,6 +904,12 @@ class Submitter (object):
             commands = [commands]
         if isinstance (command_labels, str):
             command_labels = [command_labels]
+        if resources is not None:
+            resources = dict (zip (command_labels, resources))
+        commands, command_labels = self.deduplicate (commands, command_labels)
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
         n_total = len (commands)
         length = len (str (n_total))
 
@@ -445,16 +924,22 @@ class Submitter (object):
             print (*args, file=subdag, **kwargs)
         def spr_dag_config (*args, **kwargs):
             print (*args, file=subdag_config, **kwargs)
+        config_lines = self.config_lines (job_dir)
         spr_dag ('CONFIG {0}'.format (subdag_config_filename))
-        spr_dag_config ('DAGMAN_MAX_SUBMITS_PER_INTERVAL = 50')
 
+        hostname = socket.gethostname ()
+        # submit-1 transfers files, so the execute node may not see job_dir
+        transfer = 'submit-1' in hostname
+        post_filename = write_post_script (log_dir)
+        descriptions = {}
         for n, (command, label) in enumerate (zip (commands, command_labels)):
-            dag_label = 'npx4_{0}.sh'.format (label)
-            dag_label = re.sub (r'\.', '_dot_', dag_label)
-            dag_label = re.sub (r'\+', '_plus_', dag_label)
-            dag_label = re.sub (r'-', '_minus_', dag_label)
+            dag_label = condor_dag_label (label)
             script_filename = os.path.realpath (os.path.join (
                     log_dir, dag_label))
+            if transfer:
+                checkpoint_dir = '${_CONDOR_SCRATCH_DIR:-$PWD}/checkpoint'
+            else:
+                checkpoint_dir = script_filename + '.checkpoint'
             with open (script_filename, 'w') as script:
                 def pr (*args, **kwargs):
                     print (*args, file=script, **kwargs)
@@ -463,7 +948,8 @@ class Submitter (object):
                 pr ()
                 pr ('')
                 pr ()
-                pr ('. {0}/{1}'.format (os.getenv ('HOME'), self.config))
+                for line in config_lines:
+                    pr (line)
                 pr ()
                 pr ('hostname')
                 pr ()
@@ -471,82 +957,100 @@ class Submitter (object):
                 pr ('echo Begin: `date`.')
                 pr ('echo')
                 pr ()
-                pr (command)
-                pr ('result=$?')
+                if checkpoint:
+                    for line in checkpoint_lines (command, checkpoint_dir):
+                        pr (line)
+                else:
+                    pr (command)
+                    pr ('result=$?')
                 pr ()
                 pr ('echo')
                 pr ('after=`date +%s`')
                 pr ('echo End: `date`.')
                 pr ()
                 pr ('exit $result')
-            hostname = socket.gethostname ()
             out_filename = script_filename + '.out'
             #subprocess.call ('touch {}'.format( out_filename), shell=True)
             #os.chmod (out_filename, 0o775)
             os.chmod (script_filename, 0o775)
-            tosubsub_filename = script_filename + '.sub'
-            with open (tosubsub_filename, 'w') as tosubsub:
-                def pr (*args, **kwargs):
-                    print (*args, file=tosubsub, **kwargs)
-
-                pr ('Universe       = vanilla')
-                pr ('Executable     = {0}'.format (script_filename))
-                pr ('Log            = {}/{}.log'.format (log_dir, dag_label))
-                pr ('Output         = {}/{}.out'.format (log_dir, dag_label))
-                pr ('Error          = {}/{}.err'.format (log_dir, dag_label))
-                pr ('Notification   = NEVER')
-                if 'submit-1' in hostname:
-                    pr ('should_transfer_files = YES')
-                    #pr ('when_to_transfer_output = ON_EXIT')
-                    pr ('stream_output = True')
-                if blacklist:
-                    reqs_bl = ' && '.join (
-                            ['(Machine != "{0}")'.format (host)
-                                for host in blacklist])
-                    if reqs:
-                        pr('Requirements = {} && {}'.format(reqs, reqs_bl))
-                    else:    
-                        pr('Requirements = {}'.format(reqs_bl))
-                else:
-                    if reqs:
-                        pr('Requirements = {}'.format(reqs))
-                if gpus:
-                    pr ('request_gpus = 1')
-
-                if self.memory:
-                    pr ('request_memory = {0:.2f}G'.format (self.memory))
-                if self.ncpu:
-                    pr ('request_cpus = {0:.0f}'.format (self.ncpu))
-                pr ('Queue')
+            res = self.job_resources (resources, label,
+                    reqs=reqs, blacklist=blacklist, gpus=gpus)
+            key = tuple (sorted (res.items ()))
+            if key not in descriptions:
+                tosubsub_filename = os.path.join (
+                        log_dir, 'npx4_{0:03d}.sub'.format (len (descriptions)))
+                descriptions[key] = tosubsub_filename
+                with open (tosubsub_filename, 'w') as tosubsub:
+                    def pr (*args, **kwargs):
+                        print (*args, file=tosubsub, **kwargs)
+
+                    pr ('Universe       = vanilla')
+                    pr ('Executable     = $(script)')
+                    pr ('Log            = $(script).log')
+                    pr ('Output         = $(script).out')
+                    pr ('Error          = $(script).err')
+                    pr ('Notification   = NEVER')
+                    if transfer:
+                        pr ('should_transfer_files = YES')
+                        #pr ('when_to_transfer_output = ON_EXIT')
+                        pr ('stream_output = True')
+                        if checkpoint:
+                            pr ('when_to_transfer_output = ON_EXIT_OR_EVICT')
+                            pr ('transfer_output_files = checkpoint')
+                            pr ('transfer_output_remaps = '
+                                '"checkpoint = $(script).checkpoint"')
+                    if res['blacklist']:
+                        reqs_bl = ' && '.join (
+                                ['(Machine != "{0}")'.format (host)
+                                    for host in res['blacklist']])
+                        if res['reqs']:
+                            pr('Requirements = {} && {}'.format(res['reqs'], reqs_bl))
+                        else:    
+                            pr('Requirements = {}'.format(reqs_bl))
+                    else:
+                        if res['reqs']:
+                            pr('Requirements = {}'.format(res['reqs']))
+                    if res['gpus']:
+                        pr ('request_gpus = {0:.0f}'.format (res['gpus']))
+
+                    if res['memory']:
+                        pr ('request_memory = {0:.2f}G'.format (res['memory']))
+                    if res['ncpu']:
+                        pr ('request_cpus = {0:.0f}'.format (res['ncpu']))
+                    pr ('Queue')
 
             user_str = username + '@' if username else ''
-            dag_command = 'JOB {0} {1}'.format (
-                os.path.basename (script_filename), tosubsub_filename)
-            spr_dag (dag_command)
+            dag_node = os.path.basename (script_filename)
+            spr_dag ('JOB {0} {1}'.format (dag_node, descriptions[key]))
+            spr_dag ('VARS {0} script="{1}"'.format (dag_node, script_filename))
+            spr_dag ('SCRIPT POST {0} {1} {2} $RETURN'.format (
+                dag_node, post_filename, script_filename))
 
         subdag.close ()
+        max_jobs = self.limit_dag (subdag_filename, n_total, spr_dag_config,
+                                   max_per_interval=50)
         subdag_config.close ()
 
         print ('Submitting jobs from {0} ...'.format (job_dir))
         if 'submit-1' in hostname:
-            if self.max_jobs:
+            if max_jobs:
                 npx4_command = 'condor_submit_dag -maxjobs {0} {1}'.format (
-                    self.max_jobs, os.path.realpath (subdag_filename))
+                    max_jobs, os.path.realpath (subdag_filename))
             else:
                 npx4_command = 'condor_submit_dag {0}'.format (
                     os.path.realpath (subdag_filename))
         elif 'cobalt' in hostname:
-            if self.max_jobs:
+            if max_jobs:
                 npx4_command = 'ssh submit "condor_submit_dag -maxjobs {0} {1}"'.format (
-                    self.max_jobs, os.path.realpath (subdag_filename))
+                    max_jobs, os.path.realpath (subdag_filename))
             else:
                 npx4_command = 'ssh submit "condor_submit_dag {0}"'.format (
                     os.path.realpath (subdag_filename))
         else:
-            if self.max_jobs:
+            if max_jobs:
                 npx4_command = 'ssh {0}pub.icecube.wisc.edu "ssh submit ' \
                         '\'condor_submit_dag -maxjobs {1} {2}\' "'.format (
-                            user_str, self.max_jobs, self.max_jobs,
+                            user_str, max_jobs,
                             os.path.realpath (subdag_filename))
             else:
                 npx4_command = 'ssh {0}pub.icecube.wisc.edu "ssh submit ' \
@@ -555,7 +1059,10 @@ class Submitter (object):
                             os.path.realpath (subdag_filename))
         if not self.dry:
             print ('Submitting {0} jobs.'.format (n_total))
-            os.system (npx4_command)
+            status = os.system (npx4_command)
+            if status:
+                self.release_jobs (subdag_filename)
+            self.register (commands, command_labels, status)
         else:
             print ('Prepared {0} jobs.'.format (n_total))
             self.log (npx4_command)
@@ -564,7 +1071,8 @@ class Submitter (object):
                     transfers='',
                     reqs = None,
                     username=None,
-                    userid=None):
+                    userid=None,
+                    checkpoint=False):
         """Submit jobs in parallel on the OSG Condor cluster.
 
         This method creates the job files in a temporary job_dir initialized
@@ -578,7 +1086,16 @@ class Submitter (object):
         `transfers`: files on sub-1 to transfer to grid when running job
         `username`: the username in use on sub-1
         `userid`: the userid in use for grid certification
+        `checkpoint`: if True, let jobs survive eviction (see below)
+
+        With `checkpoint`, each job gets a directory checkpoint_<label> in its
+        sandbox, passed as $SUBMITTER_CHECKPOINT_DIR.  The wrapper forwards
+        SIGTERM to the command, which should save its state there and exit;
+        the directory is transferred back on eviction and handed to the
+        restarted job, which should resume from it.  It is emptied after the
+        command succeeds.
         """
+        import socket
 
         job_dir = os.path.realpath (ensure_dir (self.job_dir))
         print ('Temporary job directory: {0}'.format (job_dir))
@@ -587,6 +1104,10 @@ class Submitter (object):
             commands = [commands]
         if isinstance (command_labels, str):
             command_labels = [command_labels]
+        commands, command_labels = self.deduplicate (commands, command_labels)
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
         n_total = len (commands)
         length = len (str (n_total))
 
@@ -627,8 +1148,14 @@ class Submitter (object):
                 pr ('echo Begin: `date`.')
                 pr ('echo')
                 pr ()
-                pr (command)
-                pr ('result=$?')
+                if checkpoint:
+                    for line in checkpoint_lines (command,
+                            '${{_CONDOR_SCRATCH_DIR:-$PWD}}/checkpoint_{0}'.format (
+                                label)):
+                        pr (line)
+                else:
+                    pr (command)
+                    pr ('result=$?')
                 pr ()
                 pr ('echo')
                 pr ('after=`date +%s`')
@@ -652,7 +1179,12 @@ class Submitter (object):
                     pr ('transfer_input_files = /tmp/x509up_u{0},{1}'.format (userid, transfers))
                 else:
                     pr ('transfer_input_files = /tmp/x509up_u{0}'.format (userid))
-                pr ('+TransferOutput=""')
+                if checkpoint:
+                    pr ('should_transfer_files = YES')
+                    pr ('when_to_transfer_output = ON_EXIT_OR_EVICT')
+                    pr ('transfer_output_files = checkpoint_{0}'.format (label))
+                else:
+                    pr ('+TransferOutput=""')
                 pr ('Universe       = vanilla')
                 pr ('Notification   = never')
                 pr ('+WantRHEL6     = True')
@@ -707,10 +1239,12 @@ class Submitter (object):
         if not self.dry:
             print ('Moving {0} jobs to {1}@sub-1.icecube.wisc.edu:/scratch/{1}/jobs/{2}'.format (
                 n_total, username, os.path.basename (job_dir)))
-            os.system (rsync_command)
-            print ('Submitting {0} jobs from {1}@sub-1.icecube.wisc.edu:/scratch/{1}/jobs/{2}'.format (
-                n_total, username, os.path.basename (job_dir)))
-            os.system (osg_command)
+            status = os.system (rsync_command)
+            if not status:
+                print ('Submitting {0} jobs from {1}@sub-1.icecube.wisc.edu:/scratch/{1}/jobs/{2}'.format (
+                    n_total, username, os.path.basename (job_dir)))
+                status = os.system (osg_command)
+            self.register (commands, command_labels, status)
         else:
             print ('Prepared {0} jobs.'.format (n_total))
             self.log (osg_command)
@@ -731,14 +1265,32 @@ class Submitter (object):
             gpus=None,
             singularity=None,
             max_per_interval=None,
+            resources=None,
+            image_cache=None,
             ):
         """Submit jobs in parallel on illume Condor cluster.
 
+        With `image_cache`, the `singularity` image is not handed to Condor as
+        +SingularityImage.  Instead, the first job on each node copies it to
+        `image_cache`_<uid> on the node, a directory only the user can write,
+        under a name given by its content hash and guarded by a lock.  The
+        copy is kept only if its SHA-256 matches, and every job re-executes
+        its script inside the local copy, or inside the shared image if
+        there is none.  Nodes that staged the image are recorded in
+        ~/.submitter/image_nodes/<hash>, and later submissions rank those
+        nodes first.
 
         `commands`: a sequence of commands, or a single command.
         `command_labels`: a sequence of command labels, or a single one.
         `username`: the username in use on condor00.
         `blacklist`: a list of hosts to avoid
+        `singularity`: the Singularity image to run jobs in.
+        `image_cache`: a node-local directory in which to stage `singularity`
+            (e.g. '/tmp/submitter_images').
+        `resources`: per-job overrides, a sequence parallel to `commands`
+            of None or dicts with any of the keys memory, ncpu, reqs, gpus
+            and blacklist.  Jobs with identical resources share one submit
+            description.
         """
         if len (commands) == 0:
             print ('warning: no jobs')
@@ -752,6 +1304,12 @@ class Submitter (object):
             commands = [commands]
         if isinstance (command_labels, str):
             command_labels = [command_labels]
+        if resources is not None:
+            resources = dict (zip (command_labels, resources))
+        commands, command_labels = self.deduplicate (commands, command_labels)
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
         n_total = len (commands)
         length = len (str (n_total))
 
@@ -768,17 +1326,55 @@ class Submitter (object):
         def spr_dag_config (*args, **kwargs):
             print (*args, file=subdag_config, **kwargs)
 
+        config_lines = self.config_lines (job_dir)
         spr_dag ('CONFIG {0}'.format (subdag_config_filename))
-        if max_per_interval:
-            spr_dag_config (
-                    'DAGMAN_MAX_SUBMITS_PER_INTERVAL =',
-                    max_per_interval)
 
+        stage_lines, image_nodes = [], []
+        if singularity and image_cache:
+            image = os.path.realpath (singularity)
+            digest = image_digest (image)
+            nodes_filename = os.path.join (ensure_dir (os.path.join (
+                os.path.expanduser ('~'), '.submitter', 'image_nodes')), digest)
+            if os.path.exists (nodes_filename):
+                with open (nodes_filename) as f:
+                    image_nodes = sorted (set (f.read ().split ()))
+            # a private directory per user, so that no one else can plant
+            # an image under the digest's name
+            stage_lines = [
+                'if [ -z "$SUBMITTER_IMAGE" ]; then',
+                '    image_dir={0}_`id -u`'.format (image_cache),
+                '    SUBMITTER_IMAGE=$image_dir/{0}.sif'.format (digest),
+                '    mkdir -p -m 700 $image_dir 2>/dev/null',
+                '    if [ -d $image_dir ] && [ ! -L $image_dir ] \\',
+                '            && [ -O $image_dir ] && chmod 700 $image_dir \\',
+                '            && [ ! -s $SUBMITTER_IMAGE ]; then',
+                '        (',
+                '            command -v flock >/dev/null && flock 9',
+                '            if [ ! -s $SUBMITTER_IMAGE ]; then',
+                '                cp {0} $SUBMITTER_IMAGE.$$ \\'.format (image),
+                '                    && echo "{0}  $SUBMITTER_IMAGE.$$" \\'.format (
+                    digest),
+                '                        | sha256sum -c --status \\',
+                '                    && mv $SUBMITTER_IMAGE.$$ $SUBMITTER_IMAGE \\',
+                '                    && hostname >> {0}'.format (nodes_filename),
+                '                rm -f $SUBMITTER_IMAGE.$$',
+                '            fi',
+                '        ) 9>$SUBMITTER_IMAGE.lock',
+                '    fi',
+                '    if [ ! -O $image_dir ] || [ ! -s $SUBMITTER_IMAGE ] \\',
+                '            || [ ! -O $SUBMITTER_IMAGE ]; then',
+                '        SUBMITTER_IMAGE={0}'.format (image),
+                '    fi',
+                '    export SUBMITTER_IMAGE',
+                '    exec singularity exec -B {0} $SUBMITTER_IMAGE "$0" "$@"'.format (
+                    job_dir),
+                'fi',
+            ]
+
+        post_filename = write_post_script (log_dir)
+        descriptions = {}
         for n, (command, label) in enumerate (zip (commands, command_labels)):
-            dag_label = 'npx4_{0}.sh'.format (label)
-            dag_label = re.sub (r'\.', '_dot_', dag_label)
-            dag_label = re.sub (r'\+', '_plus_', dag_label)
-            dag_label = re.sub (r'-', '_minus_', dag_label)
+            dag_label = condor_dag_label (label)
             script_filename = os.path.realpath (os.path.join (
                     log_dir, dag_label))
             #script_filename = os.path.realpath (os.path.join (
@@ -790,9 +1386,11 @@ class Submitter (object):
                 pr ('#!/bin/sh')
                 pr ('#$ -S /bin/sh')
                 pr ()
-                pr ('')
+                for line in stage_lines:
+                    pr (line)
                 pr ()
-                pr ('. {0}/{1}'.format (os.getenv ('HOME'), self.config))
+                for line in config_lines:
+                    pr (line)
                 pr ()
                 pr ('hostname')
                 pr ()
@@ -811,64 +1409,945 @@ class Submitter (object):
 
             os.chmod (script_filename, 0o775)
 
-            tosubsub_filename = script_filename + '.sub'
-            with open (tosubsub_filename, 'w') as tosubsub:
-                def pr (*args, **kwargs):
-                    print (*args, file=tosubsub, **kwargs)
-
-                pr ('Universe       = vanilla')
-                pr ('Executable     = {0}'.format (script_filename))
-                pr ('Log            = {}/{}.log'.format (log_dir, dag_label))
-                pr ('Output         = {}/{}.out'.format (log_dir, dag_label))
-                pr ('Error          = {}/{}.err'.format (log_dir, dag_label))
-                if singularity:
-                    pr ('+SingularityImage = "{}"'.format(singularity))
-                    pr ('requirements = HasSingularity')
-                if gpus:
-                    pr ('request_gpus = 1')
-                pr ('Notification   = NEVER')
-
-                if blacklist:
-                    reqs_bl = ' && '.join (
-                            ['(Machine != "{0}")'.format (host)
-                                for host in blacklist])
-                    if reqs:
-                        pr('Requirements = {} && {}'.format(reqs, reqs_bl))
-                    else:    
-                        pr('Requirements = {}'.format(reqs_bl))
-                else:
-                    if reqs:
-                        pr('Requirements = {}'.format(reqs))
-                if self.memory:
-                    pr ('request_memory = {0:.2f}GB'.format (self.memory))
-                if self.ncpu:
-                    pr ('request_cpus = {0:.0f}'.format (self.ncpu))
-                else:
-                    pr ('request_cpus = 1')
-                pr ('Queue')
+            res = self.job_resources (resources, label,
+                    reqs=reqs, blacklist=blacklist, gpus=gpus)
+            key = tuple (sorted (res.items ()))
+            if key not in descriptions:
+                tosubsub_filename = os.path.join (
+                        log_dir, 'illume_{0:03d}.sub'.format (len (descriptions)))
+                descriptions[key] = tosubsub_filename
+                with open (tosubsub_filename, 'w') as tosubsub:
+                    def pr (*args, **kwargs):
+                        print (*args, file=tosubsub, **kwargs)
+
+                    pr ('Universe       = vanilla')
+                    pr ('Executable     = $(script)')
+                    pr ('Log            = $(script).log')
+                    pr ('Output         = $(script).out')
+                    pr ('Error          = $(script).err')
+                    if singularity:
+                        if not stage_lines:
+                            pr ('+SingularityImage = "{}"'.format(singularity))
+                        pr ('requirements = HasSingularity')
+                    if image_nodes:
+                        pr ('Rank = stringListMember (Machine, "{0}")'.format (
+                            ','.join (image_nodes)))
+                    if res['gpus']:
+                        pr ('request_gpus = {0:.0f}'.format (res['gpus']))
+                    pr ('Notification   = NEVER')
+
+                    if res['blacklist']:
+                        reqs_bl = ' && '.join (
+                                ['(Machine != "{0}")'.format (host)
+                                    for host in res['blacklist']])
+                        if res['reqs']:
+                            pr('Requirements = {} && {}'.format(res['reqs'], reqs_bl))
+                        else:    
+                            pr('Requirements = {}'.format(reqs_bl))
+                    else:
+                        if res['reqs']:
+                            pr('Requirements = {}'.format(res['reqs']))
+                    if res['memory']:
+                        pr ('request_memory = {0:.2f}GB'.format (res['memory']))
+                    if res['ncpu']:
+                        pr ('request_cpus = {0:.0f}'.format (res['ncpu']))
+                    else:
+                        pr ('request_cpus = 1')
+                    pr ('Queue')
 
             user_str = username + '@' if username else ''
-            dag_command = 'JOB {0} {1}'.format (
-                os.path.basename (script_filename), tosubsub_filename)
-            spr_dag (dag_command)
+            dag_node = os.path.basename (script_filename)
+            spr_dag ('JOB {0} {1}'.format (dag_node, descriptions[key]))
+            spr_dag ('VARS {0} script="{1}"'.format (dag_node, script_filename))
+            spr_dag ('SCRIPT POST {0} {1} {2} $RETURN'.format (
+                dag_node, post_filename, script_filename))
 
         subdag.close ()
+        max_jobs = self.limit_dag (subdag_filename, n_total, spr_dag_config,
+                                   max_per_interval)
         subdag_config.close ()
-        hostname = socket.gethostname ()
+        # there is no ssh route to illume, so submit from here either way
+        if max_jobs:
+            condor00_command = 'condor_submit_dag -maxjobs {0} {1}'.format (
+                max_jobs, os.path.realpath (subdag_filename))
+        else:
+            condor00_command = 'condor_submit_dag {0}'.format (
+                os.path.realpath (subdag_filename))
+        if not self.dry:
+            print ('Submitting {} jobs\nfrom {} .'.format (n_total, job_dir))
+            status = os.system (condor00_command)
+            if status:
+                self.release_jobs (subdag_filename)
+            self.register (commands, command_labels, status)
+        else:
+            print ('Prepared {} jobs\n in {} .'.format (n_total, job_dir))
+            self.log (condor00_command)
 
-        if 'illume' in hostname:
-            if self.max_jobs:
-                condor00_command = 'condor_submit_dag -maxjobs {0} {1}'.format (
-                    self.max_jobs, os.path.realpath (subdag_filename))
+    def submit_slurm (self, commands, command_labels,
+            partition=None,
+            time_limit=None,
+            account=None,
+            gpus=None,
+            host=None,
+            max_array_size=1001,
+            ):
+        """Submit jobs as a single array job on a Slurm cluster.
+
+        The commands and labels are written one per line to
+        slurm_commands.txt and slurm_labels.txt, and one sbatch script runs
+        the array ``--array=0-(N-1)%max_jobs``; each task looks up its own
+        command by $SLURM_ARRAY_TASK_ID.  Sweeps larger than
+        `max_array_size` (Slurm's MaxArraySize) are submitted as several
+        arrays of the same script, each given its offset into the tables as
+        its argument.  `max_jobs` is then split between the arrays; if it is
+        smaller than the number of arrays, each array runs one task at a
+        time and waits (``--dependency=afterany``) for the array `max_jobs`
+        places before it.  With a `limiter`, the sweep's share of its budget
+        takes the place of `max_jobs`.
+
+        `commands`: a sequence of commands, or a single command.
+        `command_labels`: a sequence of command labels, or a single one.
+        `partition`: the Slurm partition to submit to.
+        `time_limit`: the time limit per task, in Slurm format
+            (e.g. '4:00:00').
+        `account`: the account to charge.
+        `gpus`: the number of GPUs per task.
+        `host`: if given, submit by ssh'ing into this host.
+        `max_array_size`: the largest array the cluster accepts.
+        """
+        import shlex
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
+        if isinstance (commands, str):
+            commands = [commands]
+        if isinstance (command_labels, str):
+            command_labels = [command_labels]
+        if len (set (command_labels)) != len (command_labels):
+            raise ValueError (
+                '`command_labels` must not include duplicate labels')
+        commands, command_labels = self.deduplicate (commands, command_labels)
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
+        job_dir = os.path.realpath (ensure_dir (self.job_dir))
+        log_dir = ensure_dir (os.path.join (job_dir, 'logs'))
+        n_total = len (commands)
+        offsets = list (range (0, n_total, max_array_size))
+
+        commands_filename = os.path.join (job_dir, 'slurm_commands.txt')
+        labels_filename = os.path.join (job_dir, 'slurm_labels.txt')
+        write_command_table (commands_filename, commands)
+        write_command_table (labels_filename, command_labels)
+
+        script_filename = os.path.join (job_dir, 'slurm_array.sh')
+        max_jobs = self.limit_array (script_filename, n_total)
+        with open (script_filename, 'w') as script:
+            def pr (*args, **kwargs):
+                print (*args, file=script, **kwargs)
+
+            pr ('#!/bin/sh')
+            if len (offsets) == 1:
+                array = '0-{0}'.format (n_total - 1)
+                if max_jobs:
+                    array += '%{0}'.format (max_jobs)
+                pr ('#SBATCH --array={0}'.format (array))
+            pr ('#SBATCH --job-name={0}'.format (os.path.basename (job_dir)))
+            pr ('#SBATCH --output={0}/slurm_%A_%a.out'.format (log_dir))
+            pr ('#SBATCH --error={0}/slurm_%A_%a.err'.format (log_dir))
+            if partition:
+                pr ('#SBATCH --partition={0}'.format (partition))
+            if time_limit:
+                pr ('#SBATCH --time={0}'.format (time_limit))
+            if account:
+                pr ('#SBATCH --account={0}'.format (account))
+            if self.memory:
+                pr ('#SBATCH --mem={0:.0f}M'.format (1024 * self.memory))
+            if self.ncpu:
+                pr ('#SBATCH --cpus-per-task={0:.0f}'.format (self.ncpu))
+            if gpus:
+                pr ('#SBATCH --gpus-per-task={0:.0f}'.format (gpus))
+            pr ()
+            for line in self.config_lines (job_dir):
+                pr (line)
+            pr ()
+            pr ('task=`expr $SLURM_ARRAY_TASK_ID + ${1:-0} + 1`')
+            pr ('label=`sed -n "${{task}}p" {0}`'.format (labels_filename))
+            pr ('command=`sed -n "${{task}}p" {0}`'.format (commands_filename))
+            pr ()
+            pr ('hostname')
+            pr ('echo Label: $label')
+            pr ()
+            if self.limiter:
+                done_lines = array_done_lines (
+                        script_filename, '$task', n_total)
             else:
-                condor00_command = 'condor_submit_dag {0}'.format (
-                    os.path.realpath (subdag_filename))
+                done_lines = []
+            for line in term_trap_lines (done_lines):
+                pr (line)
+            pr ()
+            pr ('before=`date +%s`')
+            pr ('echo Begin: `date`.')
+            pr ('echo')
+            pr ()
+            pr ('eval "$command"')
+            pr ('result=$?')
+            pr ()
+            pr ('echo')
+            pr ('after=`date +%s`')
+            pr ('echo End: `date`.')
+            pr ()
+            if done_lines:
+                for line in done_lines:
+                    pr (line)
+                pr ()
+            pr ('exit $result')
+
+        os.chmod (script_filename, 0o775)
+
+        if len (offsets) == 1:
+            slurm_command = 'sbatch {0}'.format (script_filename)
+        elif max_jobs and max_jobs < len (offsets):
+            # one task at a time per array, and each array waits for the
+            # one max_jobs places before it
+            sbatch_commands = []
+            for k, offset in enumerate (offsets):
+                array = '0-{0}%1'.format (
+                        min (max_array_size, n_total - offset) - 1)
+                if k >= max_jobs:
+                    array += ' --dependency=afterany:${{job{0}%%;*}}'.format (
+                            k - max_jobs)
+                sbatch_commands.append (
+                    'job{0}=`sbatch --parsable --array={1} {2} {3}`'.format (
+                        k, array, script_filename, offset))
+            slurm_command = ' && '.join (sbatch_commands)
+        else:
+            sbatch_commands = []
+            for k, offset in enumerate (offsets):
+                array = '0-{0}'.format (min (max_array_size, n_total - offset) - 1)
+                if max_jobs:
+                    array += '%{0}'.format (max_jobs // len (offsets)
+                            + (k < max_jobs % len (offsets)))
+                sbatch_commands.append ('sbatch --array={0} {1} {2}'.format (
+                    array, script_filename, offset))
+            slurm_command = ' && '.join (sbatch_commands)
+        if host:
+            slurm_command = 'ssh {0} {1}'.format (
+                    host, shlex.quote (slurm_command))
         if not self.dry:
             print ('Submitting {} jobs\nfrom {} .'.format (n_total, job_dir))
-            os.system (condor00_command)
+            status = os.system (slurm_command)
+            if status:
+                self.release_jobs (script_filename)
+            self.register (commands, command_labels, status)
         else:
             print ('Prepared {} jobs\n in {} .'.format (n_total, job_dir))
-            self.log (condor00_command)
+            self.log (slurm_command)
+
+    def shard_trials (self, command_fmt, label_fmt, n_trials, target_runtime,
+            seconds_per_trial=None, history=None, seed=0):
+        """Split `n_trials` trials into jobs of about `target_runtime` each.
+
+        `command_fmt` and `label_fmt` are formatted with the keywords
+        `n_trials`, `seed` and `shard` for each job, e.g.
+        ``'{script} do-ps-sens --n-trials {{n_trials}} --seed={{seed}}'``.
+        Seeds are `seed`, `seed` + 1, ... so that no two jobs repeat each
+        other's trials.  The number of trials, seed and shard number of each
+        job are recorded in shards.json in `job_dir`, so that later sweeps
+        can learn the cost per trial from these jobs' recorded durations.
+        Calling this again on the same `job_dir` continues after the highest
+        recorded seed and shard, so the new jobs add trials rather than
+        repeat them.
+
+        `n_trials`: the total number of trials.
+        `target_runtime`: the desired job duration in seconds.
+        `seconds_per_trial`: the cost of one trial.  If None, it is learned
+            from the jobs recorded in the job directories in `history`.
+        `history`: job directories of earlier sharded Condor sweeps
+            (default: `job_dir`).
+
+        Returns the lists of commands and labels.
+        """
+        import json
+        if seconds_per_trial is None:
+            seconds_per_trial = self.seconds_per_trial (history)
+            if seconds_per_trial is None:
+                raise ValueError (
+                    'no recorded durations; `seconds_per_trial` is required')
+        per_job = max (1, int (target_runtime / seconds_per_trial))
+        n_jobs = -(-n_trials // per_job)
+        job_dir = ensure_dir (self.job_dir)
+        shards_filename = os.path.join (job_dir, 'shards.json')
+        shards, first_shard = {}, 0
+        if os.path.exists (shards_filename):
+            with open (shards_filename) as f:
+                shards = json.load (f)
+            recorded = [entry for entry in shards.values ()
+                        if isinstance (entry, dict)]
+            if recorded:
+                seed = max (seed, 1 + max (e['seed'] for e in recorded))
+                first_shard = 1 + max (e['shard'] for e in recorded)
+        commands, labels = [], []
+        for k in range (n_jobs):
+            n = n_trials // n_jobs + (1 if k < n_trials % n_jobs else 0)
+            kw = dict (n_trials=n, seed=seed + k, shard=first_shard + k)
+            commands.append (command_fmt.format (**kw))
+            labels.append (label_fmt.format (**kw))
+            if labels[-1] in shards:
+                raise ValueError (
+                    'label {0!r} is already recorded in {1}; include {{seed}} '
+                    'or {{shard}} in `label_fmt`'.format (
+                        labels[-1], shards_filename))
+            shards[labels[-1]] = kw
+        with open (shards_filename, 'w') as f:
+            json.dump (shards, f, indent=1)
+        self.log ('Sharded {0} trials into {1} jobs of ~{2:.0f} s.'.format (
+            n_trials, n_jobs, per_job * seconds_per_trial))
+        return commands, labels
+
+    def seconds_per_trial (self, history=None):
+        """The median cost per trial of earlier sharded Condor sweeps.
+
+        `history`: job directories written by :meth:`shard_trials` and a
+            Condor submit method (default: `job_dir`).
+
+        Returns None if no finished jobs are found.
+        """
+        import json
+        if history is None:
+            history = [self.job_dir]
+        elif isinstance (history, str):
+            history = [history]
+        costs = []
+        for job_dir in history:
+            shards_filename = os.path.join (job_dir, 'shards.json')
+            if not os.path.exists (shards_filename):
+                continue
+            with open (shards_filename) as f:
+                shards = json.load (f)
+            for label, entry in shards.items ():
+                n = entry['n_trials'] if isinstance (entry, dict) else entry
+                job = condor_job_status (os.path.join (
+                    job_dir, 'logs', condor_dag_label (label)))
+                if job['start'] and job['end'] and n:
+                    costs.append ((job['end'] - job['start']) / n)
+        if not costs:
+            return None
+        return sorted (costs)[len (costs) // 2]
+
+    def monitor_stragglers (self, threshold=3., min_finished=10,
+            poll_interval=300, max_speculative=None, submit_host=None,
+            min_elapsed=60):
+        """Speculatively re-run the slowest jobs of a Condor DAG sweep.
+
+        This method watches the jobs written by :meth:`submit_npx4`,
+        :meth:`submit_condor00` or :meth:`submit_illume` to `job_dir`/logs.
+        Each job's start time and host are read from its Condor log (falling
+        back to the wrapper's hostname and "Begin:" lines), and its elapsed
+        time is compared with the median duration of the finished jobs in the
+        sweep.  A job running longer than `threshold` times the median, and
+        at least `min_elapsed` seconds, gets a duplicate, submitted with
+        condor_submit using the same submit file plus a requirement to avoid
+        the slow host.  Whichever copy finishes successfully first is kept
+        and the other one is removed with condor_rm.  The DAG's POST script
+        (see :func:`write_post_script`) lets the node succeed when only the
+        duplicate did.  Jobs that were removed or held count as finished.
+        Jobs submitted with `checkpoint` are never duplicated, since both
+        copies would write to the same checkpoint directory.
+
+        It must run where condor_submit works, or be given `submit_host` to
+        ssh into.  In dry mode, a single pass reports the stragglers found.
+
+        `threshold`: elapsed time, relative to the median duration, beyond
+            which a job counts as a straggler.
+        `min_finished`: the number of jobs that must have finished before
+            the median is trusted.
+        `poll_interval`: seconds between checks.
+        `max_speculative`: the maximum number of duplicates to launch.
+        `submit_host`: if given, run condor commands by ssh'ing into this host.
+        `min_elapsed`: seconds a job must have run before it can count as a
+            straggler, since the log's one-second time stamps make the median
+            of very short jobs 0.
+        """
+        import glob
+        import subprocess
+        job_dir = os.path.realpath (self.job_dir)
+        log_dir = os.path.join (job_dir, 'logs')
+        sub_filenames = {}
+        for dag_filename in glob.glob (os.path.join (job_dir, '*_submit.dag')):
+            sub_filenames.update (read_dag_jobs (dag_filename))
+        script_filenames = sorted (sub_filenames)
+        if not script_filenames:
+            print ('warning: no Condor jobs in {0}'.format (job_dir))
+            return
+        checkpointed = set ()
+        for script_filename in script_filenames:
+            with open (os.path.join (log_dir, script_filename)) as f:
+                if 'SUBMITTER_CHECKPOINT_DIR' in f.read ():
+                    checkpointed.add (script_filename)
+        if checkpointed:
+            self.log ('Not duplicating {0} checkpointed jobs.'.format (
+                len (checkpointed)))
+
+        def condor (command):
+            if submit_host:
+                command = 'ssh {0} "{1}"'.format (submit_host, command)
+            if self.dry:
+                self.log (command)
+                return ''
+            return subprocess.check_output (
+                    command, shell=True).decode ('utf-8', 'replace')
+
+        def over (job):
+            return job['end'] or job['status'] in ('removed', 'held')
+
+        speculative = {}
+        while True:
+            now = time.time ()
+            jobs = {}
+            for script_filename in script_filenames:
+                path = os.path.join (log_dir, script_filename)
+                job = condor_job_status (path)
+                jobs[script_filename] = job
+                if script_filename in speculative:
+                    spec_job = condor_job_status (path + '.spec')
+                    speculative[script_filename].update (
+                            (key, value) for (key, value) in spec_job.items ()
+                            if value is not None)
+            durations = sorted (job['end'] - job['start']
+                                for job in jobs.values ()
+                                if job['end'] and job['start'])
+            if len (durations) >= min_finished:
+                median = durations[len (durations) // 2]
+                for script_filename, job in sorted (jobs.items ()):
+                    if script_filename in speculative \
+                            or script_filename in checkpointed \
+                            or over (job) or not job['start']:
+                        continue
+                    if max_speculative is not None \
+                            and len (speculative) >= max_speculative:
+                        break
+                    elapsed = now - job['start']
+                    if elapsed <= max (threshold * median, min_elapsed):
+                        continue
+                    self.log ('{0} has run {1:.0f} s on {2} '
+                              '(median: {3:.0f} s); duplicating it.'.format (
+                                  script_filename, elapsed, job['host'], median))
+                    spec_sub = write_speculative_sub (
+                            sub_filenames[script_filename],
+                            os.path.join (log_dir, script_filename),
+                            job['host'])
+                    output = condor ('condor_submit {0}'.format (spec_sub))
+                    match = re.search (r'submitted to cluster (\d+)', output)
+                    speculative[script_filename] = dict (
+                            cluster=match and match.group (1), end=None,
+                            returncode=None, status=None)
+            if self.dry:
+                return
+
+            for script_filename, spec in speculative.items ():
+                job = jobs[script_filename]
+                if spec.get ('resolved'):
+                    continue
+                if job['end'] and job['returncode'] == 0:
+                    loser = spec['cluster']
+                elif spec['end'] and spec['returncode'] == 0:
+                    loser = job['cluster']
+                elif over (job) and over (spec):
+                    loser = None
+                else:
+                    continue
+                if loser:
+                    condor ('condor_rm {0}'.format (loser))
+                spec['resolved'] = True
+            # a duplicated job runs until one copy succeeds or both are over
+            n_running = sum (
+                    1 for (script_filename, job) in jobs.items ()
+                    if (not speculative[script_filename].get ('resolved')
+                        if script_filename in speculative else not over (job)))
+            if not n_running:
+                break
+            time.sleep (poll_interval)
+        self.log ('All {0} jobs finished ({1} duplicated).'.format (
+            len (jobs), len (speculative)))
+
+    def submit_federated (self, commands, command_labels, backends,
+            reserve=.2, poll_interval=60, timeout=86400):
+        """Split one sweep across several backends in proportion to capacity.
+
+        Each backend submits its jobs in batches, each from its own
+        subdirectory of `job_dir`.  Most jobs are handed out up front in
+        proportion to the backend weights, interleaved so that every backend
+        gets a representative slice of the sweep.  The remaining `reserve`
+        fraction is held back and handed out in small batches to whichever
+        backend runs out of queued work first, so faster pools end up doing
+        more of the sweep.
+
+        Unless `reserve` is 0 (or `dry` is set), this call blocks until the
+        whole sweep has finished.  Progress is read from the job outputs and
+        Condor logs (see :func:`count_done`), so rebalancing only involves
+        backends whose jobs are visible from this host (i.e. not osg).  Failed
+        and removed jobs count as done.  After `timeout` seconds, the jobs
+        still held back are handed out by weight and the call returns.
+
+        Only the Condor backends report every job that ends, in their logs.
+        Slurm and SGE tasks write the End: line when they exit or are sent
+        SIGTERM (see :func:`term_trap_lines`), but a task killed with
+        SIGKILL, or lost with its node, is never counted: a sweep that
+        rebalances onto slurm or cobol00 may then wait for `timeout`, so set
+        it to what the sweep can afford.
+
+        The throughput measured for each backend is stored in
+        ~/.submitter/federated_throughput.json, and is used as its weight in
+        later calls that do not give one.  Weights are raised to at least 5%
+        of the largest one, so that no backend is starved for good.
+
+        `commands`: a sequence of commands.
+        `command_labels`: a sequence of command labels.
+        `backends`: a dict mapping backend names (e.g. 'npx4' for
+            :meth:`submit_npx4`) to a weight, to None (use the measured
+            throughput), or to a (weight, kwargs) tuple where kwargs are passed
+            on to the backend's submit method.
+        `reserve`: the fraction of jobs to hold back for rebalancing.
+        `poll_interval`: seconds between progress checks.
+        `timeout`: seconds after which to stop rebalancing.
+        """
+        import copy
+        import json
+        import threading
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
+        if isinstance (commands, str):
+            commands = [commands]
+        if isinstance (command_labels, str):
+            command_labels = [command_labels]
+        if len (set (command_labels)) != len (command_labels):
+            raise ValueError (
+                '`command_labels` must not include duplicate labels')
+        commands, command_labels = self.deduplicate (commands, command_labels)
+        if len (commands) == 0:
+            print ('warning: no jobs')
+            return
+        job_dir = os.path.realpath (ensure_dir (self.job_dir))
+        throughput_filename = os.path.join (ensure_dir (os.path.join (
+            os.path.expanduser ('~'), '.submitter')), 'federated_throughput.json')
+        measured = {}
+        if os.path.exists (throughput_filename):
+            with open (throughput_filename) as f:
+                measured = json.load (f)
+
+        weights, backend_kwargs = {}, {}
+        for name, spec in backends.items ():
+            if not hasattr (self, 'submit_' + name) or name == 'federated':
+                raise ValueError ('unknown backend: {0}'.format (name))
+            if isinstance (spec, tuple):
+                weight, kwargs = spec
+            else:
+                weight, kwargs = spec, {}
+            if weight is None:
+                weight = measured.get (name, 1.)
+            weights[name] = float (weight)
+            backend_kwargs[name] = kwargs
+        top_weight = max (weights.values ())
+        for name in weights:
+            weights[name] = max (weights[name], .05 * top_weight) \
+                    if top_weight > 0 else 1.
+        names = sorted (weights)
+        watchable = [name for name in names if name != 'osg']
+
+        jobs = list (zip (commands, command_labels))
+        n_reserve = 0 if (self.dry or not watchable) \
+                else int (reserve * len (jobs))
+        n_upfront = len (jobs) - n_reserve
+
+        # largest-remainder apportionment of the up-front jobs
+        total_weight = sum (weights.values ())
+        exact = dict ((name, n_upfront * weights[name] / total_weight)
+                      for name in names)
+        shares = dict ((name, int (exact[name])) for name in names)
+        by_remainder = sorted (
+                names, key=lambda name: shares[name] - exact[name])
+        for name in by_remainder[:n_upfront - sum (shares.values ())]:
+            shares[name] += 1
+
+        # interleave so each backend sees the whole range of the sweep
+        upfront = dict ((name, []) for name in names)
+        for job in jobs[:n_upfront]:
+            name = min ((name for name in names
+                         if len (upfront[name]) < shares[name]),
+                        key=lambda name: (len (upfront[name]) + 1.) / shares[name])
+            upfront[name].append (job)
+        pending = jobs[n_upfront:]
+
+        state = dict ((name, dict (submitted=0, batches=[], rate=None))
+                      for name in names)
+        basename = os.path.basename (job_dir)
+
+        def dispatch (name, batch):
+            # each batch registers its own commands once it is submitted
+            sub = copy.copy (self)
+            sub.job_dir = os.path.join (job_dir, '{0}_{1}_{2:03d}'.format (
+                basename, name, len (state[name]['batches'])))
+            args = ([command for (command, label) in batch],
+                    [label for (command, label) in batch])
+            method = getattr (sub, 'submit_' + name)
+            self.log ('Federated: {0} jobs to {1}.'.format (len (batch), name))
+            if name in ('threads', 'serial') and not self.dry:
+                thread = threading.Thread (target=method, args=args,
+                                           kwargs=backend_kwargs[name])
+                thread.start ()
+            else:
+                thread = None
+                method (*args, **backend_kwargs[name])
+            state[name]['batches'].append (
+                    dict (job_dir=sub.job_dir, n=len (batch), thread=thread))
+            state[name]['submitted'] += len (batch)
+
+        def n_finished (name):
+            n = 0
+            for batch in state[name]['batches']:
+                if batch['thread'] is not None:
+                    n += 0 if batch['thread'].is_alive () else batch['n']
+                else:
+                    n += count_done (batch['job_dir'])
+            return n
+
+        for name in names:
+            if upfront[name]:
+                dispatch (name, upfront[name])
+        if not n_reserve:
+            return
+
+        start = time.time ()
+        batch_size = max (1, -(-n_reserve // (4 * len (watchable))))
+        while pending or any (state[name]['rate'] is None
+                              for name in watchable):
+            if time.time () - start > timeout:
+                self.log ('Federated: timed out after {0:.0f} s.'.format (
+                    time.time () - start))
+                for name in names:
+                    share = int (round (len (pending) * weights[name]
+                                        / sum (weights[n] for n in names
+                                               if n >= name)))
+                    if share:
+                        batch, pending = pending[:share], pending[share:]
+                        dispatch (name, batch)
+                break
+            time.sleep (poll_interval)
+            for name in watchable:
+                n_done = n_finished (name)
+                n_queued = state[name]['submitted'] - n_done
+                if pending and n_queued < batch_size:
+                    batch, pending = pending[:batch_size], pending[batch_size:]
+                    dispatch (name, batch)
+                elif not pending and not n_queued \
+                        and state[name]['rate'] is None:
+                    state[name]['rate'] = 3600. * n_done \
+                            / max (time.time () - start, 1.)
+        for name in watchable:
+            if state[name]['rate'] is None:
+                continue
+            measured[name] = state[name]['rate']
+            self.log ('Federated: {0} ran {1} jobs at {2:.1f} jobs/hour.'.format (
+                name, state[name]['submitted'], measured[name]))
+        with open (throughput_filename, 'w') as f:
+            json.dump (measured, f, indent=1)
+
+
+class SubmitLimiter (object):
+
+    """Host-wide job budget shared by concurrent Submitters.
+
+    The budget lives in a flock-protected JSON state file: `max_running` caps
+    the jobs running at once across all claims, and `rate` caps the jobs
+    submitted per second, with a token bucket that holds one second's worth
+    (at least one token) and is full whenever the rate is set or changed.
+    Both are stored in the state file, so a limiter
+    constructed without them uses the budget set by whoever configured it
+    last.  A claim stays alive while its process `pid` runs, or while its
+    `watch` file (e.g. a DAGMan lock file) exists, allowing `watch_grace`
+    seconds for the file to appear.  A claim whose `done` file (e.g. the
+    .dagman.out) was written after the claim ends as soon as `watch` is
+    gone, even if it was never seen.
+    """
+
+    watch_grace = 300
+
+    def __init__ (self, filename=None, max_running=None, rate=None):
+        """Use the state in `filename`.
+
+        `filename`: the state file (default:
+            /tmp/submitter_limiter_<uid>.json).
+        `max_running`: the maximum number of jobs running at once.
+        `rate`: the maximum number of jobs submitted per second.
+        """
+        if filename is None:
+            filename = '/tmp/submitter_limiter_{0}.json'.format (os.getuid ())
+        self.filename = filename
+        if max_running is not None or rate is not None:
+            def configure (state):
+                if max_running is not None:
+                    state['max_running'] = max_running
+                if rate is not None and rate != state['rate']:
+                    state['rate'], state['tokens'] = rate, None
+            self._update (configure)
+
+    def _update (self, func):
+        import fcntl
+        import json
+        with open (self.filename + '.lock', 'a') as lock:
+            fcntl.flock (lock, fcntl.LOCK_EX)
+            state = dict (max_running=None, rate=None, tokens=None,
+                          stamp=time.time (), claims={})
+            if os.path.exists (self.filename):
+                with open (self.filename) as f:
+                    state.update (json.load (f))
+            now = time.time ()
+            for key, claim in list (state['claims'].items ()):
+                if not self._alive (claim, now):
+                    del state['claims'][key]
+                elif claim.get ('watch') and os.path.exists (claim['watch']):
+                    claim['seen'] = True
+            if state['rate']:
+                capacity = max (1., state['rate'])
+                if state['tokens'] is None:
+                    state['tokens'] = capacity
+                else:
+                    state['tokens'] = min (capacity, state['tokens']
+                            + (now - state['stamp']) * state['rate'])
+            state['stamp'] = now
+            result = func (state)
+            tmp_filename = '{0}.{1}.tmp'.format (self.filename, os.getpid ())
+            with open (tmp_filename, 'w') as f:
+                json.dump (state, f)
+            os.rename (tmp_filename, self.filename)
+            return result
+
+    def _alive (self, claim, now):
+        if claim.get ('watch'):
+            if os.path.exists (claim['watch']):
+                return True
+            done = claim.get ('done')
+            if claim.get ('seen') or (done and os.path.exists (done)
+                    and os.path.getmtime (done) >= claim['time']):
+                return False
+            # the grace period covers the time before the file first appears
+            return now - claim['time'] < self.watch_grace
+        if claim.get ('pid'):
+            try:
+                os.kill (claim['pid'], 0)
+            except OSError as e:
+                return e.errno == errno.EPERM
+            return True
+        return False
+
+    def acquire (self, key, n=1, pid=None, watch=None, done=None, block=True,
+            rate_limited=False):
+        """Claim up to `n` job slots under `key`.
+
+        `pid`: the process whose lifetime the claim lasts (default: this one).
+        `watch`: a file whose existence keeps the claim alive instead.
+        `done`: a file whose writing, with `watch` absent, ends the claim.
+        `block`: whether to wait for a free slot (and token).
+        `rate_limited`: whether the claim also takes `n` rate tokens.
+
+        Returns the number of slots granted, 0 only if not `block`.
+        """
+        if pid is None and watch is None:
+            pid = os.getpid ()
+
+        def claim (state):
+            if state['max_running']:
+                used = sum (c['n'] for (k, c) in state['claims'].items ()
+                            if k != key)
+                granted = min (n, state['max_running'] - used)
+            else:
+                granted = n
+            if granted <= 0:
+                return 0
+            if rate_limited and state['rate']:
+                if state['tokens'] < granted:
+                    return 0
+                state['tokens'] -= granted
+            state['claims'][key] = dict (
+                    n=granted, pid=pid, watch=watch, done=done,
+                    time=time.time (),
+                    seen=bool (watch and os.path.exists (watch)))
+            return granted
+
+        while True:
+            granted = self._update (claim)
+            if granted or not block:
+                return granted
+            time.sleep (1 if rate_limited else 5)
+
+    def release (self, key):
+        """Give back the slots claimed under `key`."""
+        self._update (lambda state: state['claims'].pop (key, None))
+
+    def dag_submits_per_interval (self):
+        """This host's DAGMan share of `rate`, per 5 s submit interval."""
+        def share (state):
+            if not state['rate']:
+                return None
+            n_dags = sum (1 for c in state['claims'].values () if c.get ('watch'))
+            return max (1, int (5 * state['rate'] / max (1, n_dags)))
+        return self._update (share)
+
+
+class JobRegistry (object):
+
+    """File-locked index of submitted commands, shared between sweeps."""
+
+    #: seconds after which a reservation made on another host lapses
+    reservation_timeout = 86400
+
+    def __init__ (self, filename=None):
+        """Use the registry in `filename`.
+
+        `filename`: the registry file (default: ~/.submitter/registry.json).
+        """
+        if filename is None:
+            filename = os.path.join (
+                    os.path.expanduser ('~'), '.submitter', 'registry.json')
+        self.filename = os.path.realpath (filename)
+
+    def _locked (self):
+        import fcntl
+        ensure_dir (os.path.dirname (self.filename))
+        lock = open (self.filename + '.lock', 'a')
+        fcntl.flock (lock, fcntl.LOCK_EX)
+        return lock
+
+    def _load (self):
+        import json
+        if not os.path.exists (self.filename):
+            return {}
+        with open (self.filename) as f:
+            return json.load (f)
+
+    def _save (self, entries):
+        import json
+        tmp_filename = '{0}.{1}.tmp'.format (self.filename, os.getpid ())
+        with open (tmp_filename, 'w') as f:
+            json.dump (entries, f)
+        os.rename (tmp_filename, self.filename)
+
+    def _owned (self, entry, job_dir):
+        # entries of a parent directory (e.g. a federated sweep) belong to
+        # the sweeps submitted below it
+        return entry['job_dir'] == job_dir \
+                or job_dir.startswith (entry['job_dir'] + os.sep)
+
+    def _lapsed (self, entry, now):
+        import socket
+        if entry.get ('state') != 'queued':
+            return False
+        if entry.get ('host') == socket.gethostname ():
+            try:
+                os.kill (entry['pid'], 0)
+            except OSError as e:
+                return e.errno != errno.EPERM
+            return False
+        return now - entry['time'] > self.reservation_timeout
+
+    def _duplicates (self, entries, commands, command_labels, job_dir):
+        now = time.time ()
+        duplicates = {}
+        for command, label in zip (commands, command_labels):
+            entry = entries.get (command_hash (command))
+            if entry and not self._owned (entry, job_dir) \
+                    and not self._lapsed (entry, now) \
+                    and os.path.isdir (entry['job_dir']) \
+                    and not job_failed (entry['job_dir'], entry['label']):
+                duplicates[label] = entry
+        return duplicates
+
+    def duplicates (self, commands, command_labels, job_dir):
+        """Find `commands` already submitted from other job directories.
+
+        Returns a dict mapping labels of commands that are reserved or
+        registered for another, still existing job directory, and whose job
+        there is not known to have failed (see :func:`job_failed`), to their
+        entries.  Entries of a directory containing `job_dir` do not count.
+        """
+        lock = self._locked ()
+        try:
+            entries = self._load ()
+        finally:
+            lock.close ()
+        return self._duplicates (entries, commands, command_labels, job_dir)
+
+    def reserve (self, commands, command_labels, job_dir):
+        """Find duplicates like :meth:`duplicates`, and reserve the others.
+
+        Under the same lock, every command that is not a duplicate is
+        recorded as queued for `job_dir` by this process, so that an
+        overlapping sweep skips it.  A reservation lapses when its process
+        is gone, or after `reservation_timeout` seconds if it was made on
+        another host.  Returns the duplicates.
+        """
+        import socket
+        lock = self._locked ()
+        try:
+            entries = self._load ()
+            duplicates = self._duplicates (
+                    entries, commands, command_labels, job_dir)
+            now = time.time ()
+            for command, label in zip (commands, command_labels):
+                if label not in duplicates:
+                    entries[command_hash (command)] = dict (
+                            command=command, label=label, job_dir=job_dir,
+                            time=now, state='queued',
+                            host=socket.gethostname (), pid=os.getpid ())
+            self._save (entries)
+        finally:
+            lock.close ()
+        return duplicates
+
+    def register (self, commands, command_labels, job_dir):
+        """Record `commands` as submitted from `job_dir`."""
+        lock = self._locked ()
+        try:
+            entries = self._load ()
+            now = time.time ()
+            for command, label in zip (commands, command_labels):
+                entries[command_hash (command)] = dict (
+                        command=command, label=label, job_dir=job_dir,
+                        time=now, state='submitted')
+            self._save (entries)
+        finally:
+            lock.close ()
+
+    def release (self, commands, job_dir):
+        """Drop the reservations of `commands` for `job_dir`, e.g. after a
+        failed submit."""
+        lock = self._locked ()
+        try:
+            entries = self._load ()
+            for command in commands:
+                key = command_hash (command)
+                entry = entries.get (key)
+                if entry and entry.get ('state') == 'queued' \
+                        and entry['job_dir'] == job_dir:
+                    del entries[key]
+            self._save (entries)
+        finally:
+            lock.close ()
+
+    def forget (self, commands):
+        """Remove `commands` from the registry, e.g. to rerun failed jobs."""
+        lock = self._locked ()
+        try:
+            entries = self._load ()
+            for command in commands:
+                entries.pop (command_hash (command), None)
+            self._save (entries)
+        finally:
+            lock.close ()
+
+
 class Spinner (object):
 
     """Create a simple spinning progress indicator."""
@@ -908,10 +2387,487 @@ def ensure_dir (dirname):
         try:
             os.makedirs (dirname)   # throws if exists as file
         except OSError as e:
-            if e.errno != os.errno.EEXIST:
+            if e.errno != errno.EEXIST:
                 raise
     return dirname
 
+def available_cores ():
+    """The cores this process may run on."""
+    if hasattr (os, 'sched_getaffinity'):
+        return sorted (os.sched_getaffinity (0))
+    import multiprocessing
+    return list (range (multiprocessing.cpu_count ()))
+
+def available_memory ():
+    """MemAvailable from /proc/meminfo in GB, or None if unknown."""
+    try:
+        with open ('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith ('MemAvailable:'):
+                    return int (line.split ()[1]) / 1024. ** 2
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+def running_threads ():
+    """Threads running or runnable right now, besides the caller, or None.
+
+    This is procs_running from /proc/loadavg.  Unlike the load averages, it
+    drops as soon as a job ends.
+    """
+    try:
+        with open ('/proc/loadavg') as f:
+            return max (0, int (f.read ().split ()[3].split ('/')[0]) - 1)
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+def normalize_command (command):
+    """Canonical form of `command`.
+
+    The command is split like a shell would, and --opt=val becomes --opt val.
+    """
+    import shlex
+    try:
+        words = shlex.split (command)
+    except ValueError:
+        words = command.split ()
+    normalized = []
+    for word in words:
+        if word.startswith ('--') and '=' in word:
+            normalized.extend (word.split ('=', 1))
+        else:
+            normalized.append (word)
+    return ' '.join (normalized)
+
+def command_hash (command):
+    """Hash of the normalized `command`, used as its registry key."""
+    import hashlib
+    return hashlib.sha1 (normalize_command (command).encode ('utf-8')).hexdigest ()
+
+def condor_dag_label (label):
+    """The job script name that the Condor submit methods use for `label`."""
+    dag_label = 'npx4_{0}.sh'.format (label)
+    dag_label = re.sub (r'\.', '_dot_', dag_label)
+    dag_label = re.sub (r'\+', '_plus_', dag_label)
+    dag_label = re.sub (r'-', '_minus_', dag_label)
+    return dag_label
+
+def merge_shards (filenames, out_filename=None, load=None, combine=None):
+    """Stitch the outputs of the jobs made by :meth:`Submitter.shard_trials`.
+
+    `filenames`: the shard output files, or a glob pattern matching them.
+    `out_filename`: if given, save the merged result here (.npy or pickle).
+    `load`: function reading one output (default: numpy.load for .npy files,
+        otherwise pickle).
+    `combine`: function merging the list of loaded outputs (default:
+        numpy.concatenate for arrays, otherwise list concatenation).
+
+    Returns the merged result.
+    """
+    import glob
+    import pickle
+    if isinstance (filenames, str):
+        filenames = sorted (glob.glob (filenames))
+    if not filenames:
+        raise ValueError ('no shard outputs to merge')
+
+    def default_load (filename):
+        if filename.endswith ('.npy'):
+            import numpy as np
+            return np.load (filename)
+        with open (filename, 'rb') as f:
+            return pickle.load (f)
+
+    def default_combine (parts):
+        if all (hasattr (part, 'ndim') for part in parts):
+            import numpy as np
+            return np.concatenate (parts)
+        return [item for part in parts for item in part]
+
+    parts = [(load or default_load) (filename) for filename in filenames]
+    result = (combine or default_combine) (parts)
+    if out_filename:
+        if out_filename.endswith ('.npy'):
+            import numpy as np
+            np.save (out_filename, result)
+        else:
+            with open (out_filename, 'wb') as f:
+                pickle.dump (result, f, -1)
+    return result
+
+def parse_condor_time (stamp):
+    """Epoch time of a Condor log event stamp ('MM/DD hh:mm:ss' or ISO)."""
+    date, clock = stamp
+    if '/' in date:
+        date = '{0}/{1}'.format (date, time.localtime ().tm_year)
+        fmt = '%m/%d/%Y %H:%M:%S'
+    else:
+        fmt = '%Y-%m-%d %H:%M:%S'
+    return time.mktime (time.strptime (date + ' ' + clock[:8], fmt))
+
+def condor_job_status (script_filename):
+    """Summarize the Condor log and wrapper output of a job script.
+
+    `script_filename` is the job script, without the .log or .out suffix.
+
+    Returns a dict with the job's Condor `cluster`, execute `host`, `start`
+    and `end` times (epoch seconds, or None), `returncode` and `status`, the
+    last state in the log: 'idle', 'running', 'evicted', 'terminated',
+    'removed' or 'held' (or None without a log).
+    """
+    job = dict (cluster=None, host=None, start=None, end=None,
+                returncode=None, status=None)
+    statuses = {'000': 'idle', '001': 'running', '004': 'evicted',
+                '005': 'terminated', '009': 'removed', '012': 'held',
+                '013': 'idle'}
+    event_re = re.compile (
+        r'^(\d{3}) \((\d+)\.\d+\.\d+\) (\S+) (\S+) (.*)')
+    if os.path.exists (script_filename + '.log'):
+        event = None
+        with open (script_filename + '.log') as f:
+            for line in f:
+                match = event_re.match (line)
+                if match:
+                    event, job['cluster'] = match.group (1), match.group (2)
+                    job['status'] = statuses.get (event, job['status'])
+                    stamp = parse_condor_time (match.group (3, 4))
+                    if event == '001':
+                        job['start'], job['end'] = stamp, None
+                        host = re.search (r'alias=([^&>]+)', match.group (5))
+                        if host:
+                            job['host'] = host.group (1)
+                    elif event == '004':
+                        job['start'] = None
+                    elif event == '005':
+                        job['end'] = stamp
+                    continue
+                if event == '001' and 'SlotName:' in line:
+                    job['host'] = line.split ('@')[-1].strip ()
+                elif event == '005' and 'return value' in line:
+                    job['returncode'] = int (
+                            re.search (r'return value (-?\d+)', line).group (1))
+    if os.path.exists (script_filename + '.out') \
+            and not (job['host'] and job['start'] and job['end']):
+        with open (script_filename + '.out') as f:
+            lines = f.read ().splitlines ()
+        if lines and not job['host']:
+            job['host'] = lines[0].strip ()
+        for line in lines:
+            marker, _, date = line.partition (': ')
+            key = dict (Begin='start', End='end').get (marker)
+            if not key or job[key]:
+                continue
+            words = date.rstrip ('.').split ()
+            del words[4:-1]    # drop the time zone
+            try:
+                job[key] = time.mktime (time.strptime (
+                    ' '.join (words), '%a %b %d %H:%M:%S %Y'))
+            except ValueError:
+                pass
+    return job
+
+def job_failed (job_dir, label):
+    """Whether the job `label` from `job_dir` is known to have failed.
+
+    Only the Condor DAG backends leave enough behind to tell: the job failed
+    if its log ends with an abort or a non-zero return value, or if every
+    DAG in `job_dir` has exited without the job terminating successfully.
+    A speculative copy (see :meth:`Submitter.monitor_stragglers`) that
+    returned 0 counts as the job's success.
+    """
+    import glob
+    script_filename = os.path.join (job_dir, 'logs', condor_dag_label (label))
+    spec = condor_job_status (script_filename + '.spec')
+    if spec['status'] == 'terminated' and spec['returncode'] == 0:
+        return False
+    job = condor_job_status (script_filename)
+    if job['status'] == 'terminated':
+        return job['returncode'] != 0
+    if job['status'] == 'removed':
+        return True
+    dag_filenames = glob.glob (os.path.join (job_dir, '*.dag'))
+    return bool (dag_filenames) and all (
+            os.path.exists (dag_filename + '.dagman.out')
+            and not os.path.exists (dag_filename + '.lock')
+            for dag_filename in dag_filenames)
+
+def write_post_script (log_dir):
+    """Write the DAG POST script that accepts speculative copies of a job.
+
+    The script is called as ``post.sh <script> $RETURN``.  It exits with 0,
+    letting the node succeed, if the job returned 0 or if its speculative
+    copy (see :meth:`Submitter.monitor_stragglers`) terminated with return
+    value 0, and with 1 otherwise.  Returns its filename.
+    """
+    filename = os.path.join (log_dir, 'post.sh')
+    with open (filename, 'w') as f:
+        for line in [
+                '#!/bin/sh',
+                'if [ "$2" = 0 ]; then exit 0; fi',
+                'if [ -f "$1.spec.log" ] \\',
+                '        && grep -q "(return value 0)" "$1.spec.log"; then',
+                '    exit 0',
+                'fi',
+                'exit 1']:
+            print (line, file=f)
+    os.chmod (filename, 0o775)
+    return filename
+
+def read_dag_jobs (dag_filename):
+    """Map the job scripts of a submitted DAG to their submit files."""
+    sub_filenames, scripts = {}, {}
+    with open (dag_filename) as f:
+        for line in f:
+            words = line.split (None, 2)
+            if len (words) < 3:
+                continue
+            if words[0] == 'JOB':
+                sub_filenames[words[1]] = words[2].strip ()
+            elif words[0] == 'VARS':
+                match = re.search (r'script="([^"]*)"', words[2])
+                if match:
+                    scripts[words[1]] = os.path.basename (match.group (1))
+    return dict ((scripts.get (node, node), sub_filename)
+                 for (node, sub_filename) in sub_filenames.items ())
+
+def write_speculative_sub (sub_filename, script_filename, host):
+    """Write a submit file for a copy of a job that avoids `host` (if known).
+
+    The copy is based on the job's submit file `sub_filename`, with
+    $(script) set to `script_filename`, and logs to
+    <script>.spec.{log,out,err}.  Its filename is returned.
+    """
+    spec_filename = script_filename + '.spec.sub'
+    avoid = '(Machine != "{0}")'.format (host)
+    with open (sub_filename) as f:
+        lines = f.read ().replace ('$(script)', script_filename).splitlines ()
+    reqs_index = None
+    for i, line in enumerate (lines):
+        key, _, value = line.partition ('=')
+        key = key.strip ().lower ()
+        if key in ('log', 'output', 'error'):
+            value = value.strip ()
+            base, ext = os.path.splitext (value)
+            lines[i] = '{0} = {1}.spec{2}'.format (key.capitalize (), base, ext)
+        elif key == 'requirements':
+            reqs_index = i
+    if not host:
+        pass
+    elif reqs_index is None:
+        lines.insert (len (lines) - 1, 'Requirements = {0}'.format (avoid))
+    else:
+        lines[reqs_index] += ' && {0}'.format (avoid)
+    with open (spec_filename, 'w') as f:
+        for line in lines:
+            print (line, file=f)
+    return spec_filename
+
+def image_digest (filename):
+    """The SHA-256 of the file `filename`, cached by size and mtime."""
+    import hashlib
+    import json
+    cache_filename = os.path.join (ensure_dir (os.path.join (
+        os.path.expanduser ('~'), '.submitter')), 'image_digests.json')
+    cache = {}
+    if os.path.exists (cache_filename):
+        with open (cache_filename) as f:
+            cache = json.load (f)
+    stat = os.stat (filename)
+    key = '{0}:{1}:{2}'.format (filename, stat.st_size, stat.st_mtime)
+    if key not in cache:
+        h = hashlib.sha256 ()
+        with open (filename, 'rb') as f:
+            for chunk in iter (lambda: f.read (1 << 20), b''):
+                h.update (chunk)
+        cache[key] = h.hexdigest ()
+        with open (cache_filename, 'w') as f:
+            json.dump (cache, f)
+    return cache[key]
+
+def env_capture_lines (config_filename):
+    """Shell lines that print what sourcing `config_filename` changes.
+
+    The output can be sourced to replay the config: variables it unsets are
+    unset, ones it sets are set to the captured value, and ones it extends
+    (e.g. PATH=/opt/x/bin:$PATH) are written around the variable's value at
+    replay time, so the environment the job starts with is kept.  Only
+    exported variables are considered.
+    """
+    names = ("env | sed -n 's/^\\([A-Za-z_][A-Za-z0-9_]*\\)=.*/\\1/p'")
+    return [
+        'quote () {',
+        "    printf \"'%s'\" \"$(printf '%s' \"$1\" | sed \"s/'/'\\\\\\\\''/g\")\"",
+        '}',
+        'names=`{0}`'.format (names),
+        'for name in $names; do',
+        '    eval "_submitter_old_$name=\\${$name}"',
+        'done',
+        '. {0} >/dev/null 2>&1'.format (config_filename),
+        'for name in `(echo "$names"; {0}) | sort -u`; do'.format (names),
+        '    case $name in',
+        '        HOME|USER|PWD|OLDPWD|SHLVL|_|_submitter_*) continue ;;',
+        '    esac',
+        '    eval "set=\\${$name+1} new=\\${$name-}"',
+        '    eval "was=\\${_submitter_old_$name+1} old=\\${_submitter_old_$name-}"',
+        '    if [ -z "$set" ]; then',
+        '        if [ -n "$was" ]; then echo "unset $name"; fi',
+        '        continue',
+        '    fi',
+        '    if [ -n "$was" ] && [ "$new" = "$old" ]; then continue; fi',
+        '    case $new in',
+        '        ?*"$old"*|*"$old"?*)',
+        '            if [ -n "$was" ] && [ -n "$old" ]; then',
+        '                echo "$name=`quote "${new%%"$old"*}"`\\"\\$$name\\"`quote "${new#*"$old"}"`; export $name"',
+        '                continue',
+        '            fi',
+        '            ;;',
+        '    esac',
+        '    echo "$name=`quote "$new"`; export $name"',
+        'done',
+    ]
+
+def checkpoint_lines (command, checkpoint_dir):
+    """Wrapper lines that run `command` with SIGTERM forwarded to it.
+
+    The command finds `checkpoint_dir` in $SUBMITTER_CHECKPOINT_DIR.  It
+    should save its state there when sent SIGTERM and resume from it when
+    restarted.  If the job is sent SIGTERM, the wrapper exits with status
+    143 once the command has, leaving the directory as it is and skipping
+    the lines after these, such as the End: line.  Otherwise the directory is
+    emptied once the command succeeds.
+    """
+    import shlex
+    return [
+        'SUBMITTER_CHECKPOINT_DIR={0}'.format (checkpoint_dir),
+        'export SUBMITTER_CHECKPOINT_DIR',
+        'mkdir -p $SUBMITTER_CHECKPOINT_DIR',
+        'sh -c {0} &'.format (shlex.quote (command)),
+        'child=$!',
+        'evicted=',
+        "trap 'evicted=1; kill -TERM $child 2>/dev/null' TERM",
+        'wait $child',
+        'result=$?',
+        'if [ $result -gt 128 ]; then',
+        '    wait $child',
+        '    status=$?',
+        '    if [ $status -ne 127 ]; then result=$status; fi',
+        'fi',
+        'if [ -n "$evicted" ]; then',
+        '    echo Evicted: `date`.',
+        '    exit 143',
+        'fi',
+        'if [ $result -eq 0 ]; then rm -rf $SUBMITTER_CHECKPOINT_DIR/*; fi',
+    ]
+
+def array_done_lines (script_filename, task, n_total):
+    """Wrapper lines that remove <script>.running once `n_total` tasks ran.
+
+    `task` is the shell expression for the task's index.  Each task records
+    it in <script>.done, and the last one removes the file that keeps the
+    array's claim on the :class:`SubmitLimiter` budget alive.
+    """
+    return [
+        'echo {0} >> {1}.done'.format (task, script_filename),
+        'if [ `sort -u {0}.done | wc -l` -ge {1} ]; then'.format (
+            script_filename, n_total),
+        '    rm -f {0}.running'.format (script_filename),
+        'fi',
+    ]
+
+def term_trap_lines (lines=()):
+    """Wrapper lines that end the output with End: if the job gets SIGTERM.
+
+    Slurm sends SIGTERM to every process of a task it cancels, times out or
+    preempts, before SIGKILL.  The trap then writes the End: line, so that
+    :func:`count_done` counts the task as over, runs `lines` and exits with
+    status 143.  Tasks killed outright with SIGKILL (e.g. by SGE's qdel) or
+    lost with their node still never write it.
+    """
+    return [
+        'on_term () {',
+        '    echo',
+        '    echo Killed: `date`.',
+        '    echo End: `date`.',
+    ] + ['    ' + line for line in lines] + [
+        '    exit 143',
+        '}',
+        'trap on_term TERM',
+    ]
+
+def write_command_table (filename, lines):
+    """Write `lines` to `filename`, one per line, for lookup by task index."""
+    with open (filename, 'w') as f:
+        for line in lines:
+            if '\n' in line:
+                raise ValueError (
+                    'commands and labels must not contain newlines: '
+                    '{0!r}'.format (line))
+            print (line, file=f)
+
+def count_finished (job_dir):
+    """Count job outputs under `job_dir` ending with the wrapper's End: line.
+
+    `job_dir` may also be a single output file.
+    """
+    n = 0
+    if os.path.isfile (job_dir):
+        walk = [(os.path.dirname (job_dir), [], [os.path.basename (job_dir)])]
+    else:
+        walk = os.walk (job_dir)
+    for dirpath, dirnames, filenames in walk:
+        for filename in filenames:
+            if not re.search (r'\.(out|o\d+(\.\d+)?)$', filename):
+                continue
+            with open (os.path.join (dirpath, filename), 'rb') as f:
+                f.seek (0, os.SEEK_END)
+                f.seek (max (0, f.tell () - 256))
+                lines = f.read ().splitlines ()
+            if lines and lines[-1].startswith (b'End: '):
+                n += 1
+    return n
+
+def count_done (job_dir):
+    """Count the jobs under `job_dir` that are over, successfully or not.
+
+    A job is over if its output ends with the wrapper's End: line (which
+    Slurm and SGE tasks killed with SIGKILL never write), or if its Condor
+    log ends with a terminated (005), aborted (009) or held (012) event.  If
+    every DAG in `job_dir` has been run and its DAGMan has exited, all of its
+    nodes are over.
+    """
+    import glob
+    dag_filenames = glob.glob (os.path.join (job_dir, '*.dag'))
+    if dag_filenames and all (
+            os.path.exists (dag_filename + '.dagman.out')
+            and not os.path.exists (dag_filename + '.lock')
+            for dag_filename in dag_filenames):
+        n = 0
+        for dag_filename in dag_filenames:
+            with open (dag_filename) as f:
+                n += sum (1 for line in f if line.startswith ('JOB '))
+        return n
+    done = set ()
+    event_re = re.compile (r'^(\d{3}) \(')
+    for dirpath, dirnames, filenames in os.walk (job_dir):
+        for filename in filenames:
+            if '.spec.' in filename:
+                continue
+            path = os.path.join (dirpath, filename)
+            base, ext = os.path.splitext (path)
+            if ext == '.log':
+                event = None
+                with open (path) as f:
+                    for line in f:
+                        match = event_re.match (line)
+                        if match and match.group (1) in (
+                                '001', '004', '005', '009', '012', '013'):
+                            event = match.group (1)
+                if event in ('005', '009', '012'):
+                    done.add (base)
+            elif count_finished (path):
+                done.add (base)
+    return len (done)
+
 def gsiftp_wrapper (filename):
     return 'gsiftp://gridftp-users.icecube.wisc.edu{0}'.format (filename)
 
@@ -932,6 +2888,7 @@ def on_cobol (submitter, func, *args, **kwargs):
     environment script on the cobols.
 
     """
+    import socket
     import cache
     from misc import ensure_dir
     user = os.getenv ('USER')
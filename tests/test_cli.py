@@ -0,0 +1,106 @@
+# test_cli.py
+
+"""Tests for the JSON-lines command line interface."""
+
+import os
+
+import pytest
+
+from submitter import cli
+from submitter.submitter import Submitter
+
+
+@pytest.fixture
+def submitted (monkeypatch):
+    """Record submit_serial and submit_npx4 calls instead of submitting."""
+    calls = []
+    def record (self, commands, labels, **kwargs):
+        calls.append (dict (job_dir=self.job_dir, commands=list (commands),
+                            labels=list (labels), memory=self.memory,
+                            limiter=self.limiter, kwargs=kwargs))
+    monkeypatch.setattr (Submitter, 'submit_serial', record, raising=False)
+    monkeypatch.setattr (Submitter, 'submit_npx4', record)
+    return calls
+
+
+def run (tmp_path, backend, lines, *args):
+    filename = str (tmp_path / 'jobs.jsonl')
+    with open (filename, 'w') as f:
+        f.write ('\n'.join (lines) + '\n')
+    job_dir = str (tmp_path / 'jobs')
+    cli.main ([backend, filename, '--job-dir', job_dir] + list (args))
+    return job_dir
+
+
+def test_parse_job ():
+    assert cli.parse_job ('"echo a"', 3) == ('echo a', 'job_0000003',
+                                              (None, None, None))
+    assert cli.parse_job (
+        '{"command": "echo b", "label": 7, "memory": 2, "cpus": 4, '
+        '"requirements": "x"}', 0) == ('echo b', '7', (2, 4, 'x'))
+
+
+@pytest.mark.parametrize ('line, message', [
+    ('{"command": "echo a"', 'line 5: '),
+    ('[1]', 'line 5: expected a JSON object or string'),
+    ('{"label": "x"}', 'line 5: missing "command"'),
+])
+def test_parse_job_errors (line, message):
+    with pytest.raises (ValueError) as e:
+        cli.parse_job (line, 4)
+    assert str (e.value).startswith (message)
+
+
+def test_bad_line_is_reported (tmp_path, submitted, capsys):
+    with pytest.raises (SystemExit):
+        run (tmp_path, 'serial', ['"echo a"', '', '{"label": "x"}'])
+    assert 'line 3: missing "command"' in capsys.readouterr ().err
+    assert submitted == []
+
+
+def test_groups_by_resources (tmp_path, submitted):
+    job_dir = run (tmp_path, 'serial', [
+        '{"command": "a", "memory": 2}',
+        '{"command": "b"}',
+        '{"command": "c", "memory": 2}',
+    ])
+    assert sorted ((call['job_dir'], call['commands'], call['memory'])
+                   for call in submitted) == [
+        (os.path.join (job_dir, 'group_000'), ['a', 'c'], 2),
+        (os.path.join (job_dir, 'group_001'), ['b'], None),
+    ]
+
+
+def test_per_job_resources (tmp_path, submitted):
+    job_dir = run (tmp_path, 'npx4', [
+        '{"command": "a", "memory": 2}', '"b"'], '-o', 'username="me"')
+    [call] = submitted
+    assert call['job_dir'] == job_dir
+    assert call['commands'] == ['a', 'b']
+    assert call['kwargs'] == dict (resources=[dict (memory=2), None],
+                                   username='me')
+
+
+def test_short_input_is_not_chunked (tmp_path, submitted):
+    job_dir = run (tmp_path, 'npx4', ['"a"', '"b"'], '--chunk-size', '2')
+    assert [call['job_dir'] for call in submitted] == [job_dir]
+
+
+def test_chunks (tmp_path, submitted):
+    job_dir = run (tmp_path, 'npx4', ['"{0}"'.format (i) for i in range (5)],
+                   '--chunk-size', '2', '--max-jobs', '3')
+    assert [(os.path.relpath (call['job_dir'], job_dir), call['commands'])
+            for call in submitted] == [
+        ('chunk_0000', ['0', '1']),
+        ('chunk_0001', ['2', '3']),
+        ('chunk_0002', ['4']),
+    ]
+    limiters = set (id (call['limiter']) for call in submitted)
+    assert len (limiters) == 1 and submitted[0]['limiter'] is not None
+
+
+def test_chunks_need_a_limited_backend (tmp_path, submitted):
+    with pytest.raises (SystemExit):
+        run (tmp_path, 'serial', ['"a"', '"b"', '"c"'],
+             '--chunk-size', '2', '--max-jobs', '3')
+    assert submitted == []
@@ -0,0 +1,45 @@
+# test_env_cache.py
+
+"""Tests for replaying the environment set up by the shell config."""
+
+import os
+import subprocess
+
+from submitter import Submitter
+from submitter.submitter import env_capture_lines
+
+
+CONFIG = '''echo noise
+export PATH=/opt/x/bin:$PATH
+export GREETING="it's \\"quoted\\""
+unset GONE
+'''
+
+
+def replay (lines, **env):
+    script = '\n'.join (lines) + '\necho "$PATH|$GREETING|${GONE-unset}"'
+    return subprocess.check_output (
+        ['sh', '-c', script], env=env).decode ().strip ()
+
+
+def test_capture_keeps_the_job_environment (tmp_path):
+    config = tmp_path / 'config'
+    config.write_text (CONFIG)
+    snapshot = subprocess.check_output (
+        ['sh', '-c', '\n'.join (env_capture_lines (str (config)))],
+        env=dict (PATH='/usr/bin:/bin', GONE='1')).decode ()
+    assert 'noise' not in snapshot
+    assert replay ([snapshot], PATH='/usr/local/bin:/usr/bin', GONE='1') == \
+        '/opt/x/bin:/usr/local/bin:/usr/bin|it\'s "quoted"|unset'
+
+
+def test_submit_snapshot (tmp_path, monkeypatch):
+    (tmp_path / '.bashrc_condor').write_text (CONFIG)
+    monkeypatch.setenv ('HOME', str (tmp_path))
+    job_dir = tmp_path / 'jobs'
+    job_dir.mkdir ()
+    sub = Submitter (job_dir=str (job_dir), env_cache='submit')
+    lines = sub.config_lines (str (job_dir))
+    assert lines[0].startswith ('. {0}/env_'.format (job_dir))
+    assert replay (lines, PATH='/usr/local/bin:/bin') == \
+        '/opt/x/bin:/usr/local/bin:/bin|it\'s "quoted"|unset'
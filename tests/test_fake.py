@@ -0,0 +1,101 @@
+# test_fake.py
+
+"""End-to-end sweeps through the fake schedulers in `submitter.fake`."""
+
+import os
+import signal
+import subprocess
+import time
+
+import pytest
+
+from submitter.bench import makespan
+from submitter.submitter import term_trap_lines, write_post_script
+
+
+#: (backend, options) pairs that go through the fakes
+BACKENDS = [
+    ('npx4', {}),
+    ('condor00', {}),
+    ('illume', {}),
+    ('osg', {}),
+    ('cobol00', {}),
+    ('cobol00', {'array': True}),
+    ('slurm', {}),
+    ('slurm', {'max_array_size': 3}),
+]
+
+IDS = ['{0}{1}'.format (backend, ''.join (
+    '-{0}={1}'.format (key, value) for (key, value) in sorted (options.items ())))
+    for (backend, options) in BACKENDS]
+
+
+@pytest.mark.parametrize ('backend, options', BACKENDS, ids=IDS)
+def test_all_jobs_complete (backend, options):
+    result = makespan (backend, n_jobs=8, duration=.1, slots=4, **options)
+    assert result['completed'] == 8
+    assert result['makespan'] >= result['ideal']
+
+
+@pytest.mark.parametrize ('backend, options', BACKENDS, ids=IDS)
+def test_evicted_jobs_are_rerun (backend, options):
+    result = makespan (backend, n_jobs=8, duration=.3, slots=4,
+                       eviction=.5, evict_after=.1, **options)
+    assert result['completed'] == 8
+    assert result['makespan'] >= result['ideal']
+
+
+@pytest.mark.parametrize ('backend, options', BACKENDS, ids=IDS)
+def test_failed_jobs_do_not_complete (backend, options):
+    result = makespan (backend, n_jobs=24, duration=.05, slots=4,
+                       failure=.5, **options)
+    assert 0 < result['completed'] < 24
+    result = makespan (backend, n_jobs=4, duration=.1, slots=4,
+                       failure=1., **options)
+    assert result['completed'] == 0
+
+
+def test_slurm_chains_arrays_beyond_max_jobs ():
+    result = makespan ('slurm', n_jobs=8, duration=.3, slots=4, max_jobs=2,
+                       max_array_size=2)
+    assert result['completed'] == 8
+    # at most two tasks at once
+    assert result['makespan'] >= 4 * .3
+
+
+def test_threads_complete ():
+    result = makespan ('threads', n_jobs=4, duration=.1, slots=4)
+    assert result['completed'] == 4
+
+
+def test_post_script_accepts_speculative_copy (tmp_path):
+    post = write_post_script (str (tmp_path))
+    script = str (tmp_path / 'job.sh')
+    def post_status (returncode):
+        return subprocess.call ([post, script, str (returncode)])
+    assert post_status (0) == 0
+    assert post_status (1) == 1
+    (tmp_path / 'job.sh.spec.log').write_text (
+        '005 (7.000.000) Job terminated.\n'
+        '\t(1) Normal termination (return value 1)\n')
+    assert post_status (-1) == 1
+    (tmp_path / 'job.sh.spec.log').write_text (
+        '005 (7.000.000) Job terminated.\n'
+        '\t(1) Normal termination (return value 0)\n')
+    assert post_status (-1) == 0
+
+
+def test_terminated_task_writes_end (tmp_path):
+    done = tmp_path / 'done'
+    script = '\n'.join (term_trap_lines (['echo 1 >> {0}'.format (done)])
+                        + ['echo Begin: `date`.', 'sleep 30', 'echo finished'])
+    with open (str (tmp_path / 'out'), 'w') as out:
+        proc = subprocess.Popen (['sh', '-c', script], stdout=out,
+                                 preexec_fn=os.setsid)
+        time.sleep (.5)
+        os.killpg (proc.pid, signal.SIGTERM)
+        assert proc.wait () == 143
+    lines = (tmp_path / 'out').read_text ().splitlines ()
+    assert lines[-1].startswith ('End: ')
+    assert 'finished' not in lines
+    assert done.read_text () == '1\n'
@@ -0,0 +1,84 @@
+# test_limiter.py
+
+"""Tests for the host-wide `SubmitLimiter` budget."""
+
+import os
+import subprocess
+import time
+
+import pytest
+
+from submitter.submitter import SubmitLimiter
+
+
+@pytest.fixture
+def limiter (tmp_path):
+    return SubmitLimiter (str (tmp_path / 'limiter.json'), max_running=10)
+
+
+def test_acquire_and_release (limiter):
+    assert limiter.acquire ('a', 4) == 4
+    assert limiter.acquire ('b', 10, block=False) == 6
+    assert limiter.acquire ('c', 1, block=False) == 0
+    limiter.release ('a')
+    assert limiter.acquire ('c', 3, block=False) == 3
+
+
+def test_claim_ends_with_its_process (limiter):
+    proc = subprocess.Popen (['true'])
+    proc.wait ()
+    assert limiter.acquire ('a', 10, pid=proc.pid) == 10
+    assert limiter.acquire ('b', 5, block=False) == 5
+
+
+def test_watch_keeps_claim_until_removed (limiter, tmp_path):
+    watch = tmp_path / 'dag.lock'
+    watch.write_text ('')
+    assert limiter.acquire ('a', 10, watch=str (watch)) == 10
+    assert limiter.acquire ('b', 1, block=False) == 0
+    watch.unlink ()
+    assert limiter.acquire ('b', 1, block=False) == 1
+
+
+def test_watch_grace (limiter, tmp_path, monkeypatch):
+    watch = str (tmp_path / 'dag.lock')
+    assert limiter.acquire ('a', 10, watch=watch) == 10
+    assert limiter.acquire ('b', 1, block=False) == 0
+    monkeypatch.setattr (SubmitLimiter, 'watch_grace', 0)
+    assert limiter.acquire ('b', 1, block=False) == 1
+
+
+def test_done_ends_claim_never_seen (limiter, tmp_path):
+    watch = str (tmp_path / 'dag.lock')
+    done = tmp_path / 'dag.dagman.out'
+    done.write_text ('')
+    old = time.time () - 60
+    os.utime (str (done), (old, old))
+    assert limiter.acquire ('a', 10, watch=watch, done=str (done)) == 10
+    # a .dagman.out left by an earlier run does not end the claim
+    assert limiter.acquire ('b', 1, block=False) == 0
+    done.write_text ('finished')
+    assert limiter.acquire ('b', 1, block=False) == 1
+
+
+def test_token_bucket (tmp_path):
+    limiter = SubmitLimiter (str (tmp_path / 'limiter.json'), rate=2)
+    # the bucket starts full
+    granted = [limiter.acquire (str (i), rate_limited=True, block=False)
+               for i in range (4)]
+    assert granted == [1, 1, 0, 0]
+    time.sleep (.6)
+    assert limiter.acquire ('x', rate_limited=True, block=False) == 1
+    assert limiter.acquire ('y', rate_limited=True, block=False) == 0
+    # setting the same rate again does not refill it
+    limiter = SubmitLimiter (str (tmp_path / 'limiter.json'), rate=2)
+    assert limiter.acquire ('z', rate_limited=True, block=False) == 0
+
+
+def test_dag_submits_per_interval (tmp_path):
+    limiter = SubmitLimiter (str (tmp_path / 'limiter.json'), rate=2)
+    assert limiter.dag_submits_per_interval () == 10
+    watch = str (tmp_path / 'dag.lock')
+    limiter.acquire ('a', 1, watch=watch)
+    limiter.acquire ('b', 1, watch=watch)
+    assert limiter.dag_submits_per_interval () == 5
@@ -0,0 +1,143 @@
+# test_registry.py
+
+"""Tests for the registry of submitted commands shared between sweeps."""
+
+import json
+import os
+import subprocess
+
+from submitter import Submitter
+from submitter.submitter import (
+    JobRegistry, command_hash, condor_dag_label, job_failed,
+    normalize_command)
+
+
+def make_dirs (tmp_path, *names):
+    dirs = []
+    for name in names:
+        (tmp_path / name).mkdir ()
+        dirs.append (os.path.realpath (str (tmp_path / name)))
+    return dirs
+
+
+def write_log (job_dir, label, *events, **kwargs):
+    log_dir = os.path.join (job_dir, 'logs')
+    if not os.path.isdir (log_dir):
+        os.mkdir (log_dir)
+    filename = os.path.join (log_dir, condor_dag_label (label) + kwargs.get (
+        'suffix', '') + '.log')
+    with open (filename, 'w') as f:
+        for event in events:
+            f.write (event + '\n')
+
+
+SUBMITTED = '000 (7.000.000) 10/19 12:00:00 Job submitted from host.'
+TERMINATED = '005 (7.000.000) 10/19 12:05:00 Job terminated.'
+REMOVED = '009 (7.000.000) 10/19 12:05:00 Job was aborted.'
+
+
+def test_normalize_command ():
+    assert normalize_command ("python  fit.py --seed=1 'a b'") == \
+        normalize_command ('python fit.py --seed 1 "a b"') == \
+        'python fit.py --seed 1 a b'
+    assert normalize_command ('echo "unbalanced') == 'echo "unbalanced'
+    assert command_hash ('a --x=1') == command_hash ('a  --x 1')
+
+
+def test_reservation_blocks_overlapping_sweep (tmp_path):
+    registry = JobRegistry (str (tmp_path / 'registry.json'))
+    first, second = make_dirs (tmp_path, 'first', 'second')
+    assert registry.reserve (['a', 'b'], ['A', 'B'], first) == {}
+    duplicates = registry.reserve (['b', 'c'], ['B2', 'C'], second)
+    assert list (duplicates) == ['B2']
+    assert duplicates['B2']['job_dir'] == first
+    assert duplicates['B2']['state'] == 'queued'
+    # reserving again from the same directory is not a duplicate
+    assert registry.reserve (['a'], ['A'], first) == {}
+
+
+def test_release_drops_only_own_reservations (tmp_path):
+    registry = JobRegistry (str (tmp_path / 'registry.json'))
+    first, second = make_dirs (tmp_path, 'first', 'second')
+    registry.reserve (['a'], ['A'], first)
+    registry.release (['a'], second)
+    assert list (registry.duplicates (['a'], ['A'], second)) == ['A']
+    registry.release (['a'], first)
+    assert registry.duplicates (['a'], ['A'], second) == {}
+    registry.register (['a'], ['A'], first)
+    registry.release (['a'], first)
+    assert list (registry.duplicates (['a'], ['A'], second)) == ['A']
+    registry.forget (['a'])
+    assert registry.duplicates (['a'], ['A'], second) == {}
+
+
+def test_subdirectories_take_over_reservations (tmp_path):
+    registry = JobRegistry (str (tmp_path / 'registry.json'))
+    parent, other = make_dirs (tmp_path, 'parent', 'other')
+    child = os.path.join (parent, 'parent_condor00_000')
+    os.mkdir (child)
+    registry.reserve (['a'], ['A'], parent)
+    assert registry.reserve (['a'], ['A'], child) == {}
+    assert registry.duplicates (['a'], ['A'], other)['A']['job_dir'] == child
+
+
+def test_reservation_of_dead_process_lapses (tmp_path):
+    filename = str (tmp_path / 'registry.json')
+    registry = JobRegistry (filename)
+    first, second = make_dirs (tmp_path, 'first', 'second')
+    registry.reserve (['a', 'b'], ['A', 'B'], first)
+    proc = subprocess.Popen (['true'])
+    proc.wait ()
+    with open (filename) as f:
+        entries = json.load (f)
+    entries[command_hash ('a')]['pid'] = proc.pid
+    entries[command_hash ('b')].update (host='elsewhere', time=0)
+    with open (filename, 'w') as f:
+        json.dump (entries, f)
+    assert registry.duplicates (['a', 'b'], ['A', 'B'], second) == {}
+
+
+def test_submitter_releases_failed_submit (tmp_path):
+    registry = JobRegistry (str (tmp_path / 'registry.json'))
+    first, second = make_dirs (tmp_path, 'first', 'second')
+    sub = Submitter (job_dir=first)
+    sub.registry = registry
+    assert sub.deduplicate (['a', 'b'], ['A', 'B']) == (['a', 'b'], ['A', 'B'])
+    sub.register (['a'], ['A'], 256)
+    sub.register (['b'], ['B'])
+    assert list (registry.duplicates (['a', 'b'], ['A', 'B'], second)) == ['B']
+    assert registry.duplicates (['b'], ['B'], second)['B']['state'] == \
+        'submitted'
+
+
+def test_dry_deduplicate_does_not_reserve (tmp_path):
+    registry = JobRegistry (str (tmp_path / 'registry.json'))
+    first, second = make_dirs (tmp_path, 'first', 'second')
+    sub = Submitter (job_dir=first, dry=True)
+    sub.registry = registry
+    sub.deduplicate (['a'], ['A'])
+    assert registry.duplicates (['a'], ['A'], second) == {}
+
+
+def test_job_failed (tmp_path):
+    job_dir, = make_dirs (tmp_path, 'jobs')
+    assert not job_failed (job_dir, 'unknown')
+    write_log (job_dir, 'ok', SUBMITTED, TERMINATED,
+               '\t(1) Normal termination (return value 0)')
+    assert not job_failed (job_dir, 'ok')
+    write_log (job_dir, 'bad', SUBMITTED, TERMINATED,
+               '\t(1) Normal termination (return value 3)')
+    assert job_failed (job_dir, 'bad')
+    write_log (job_dir, 'bad', SUBMITTED, TERMINATED,
+               '\t(1) Normal termination (return value 0)', suffix='.spec')
+    assert not job_failed (job_dir, 'bad')
+    write_log (job_dir, 'removed', SUBMITTED, REMOVED)
+    assert job_failed (job_dir, 'removed')
+    write_log (job_dir, 'idle', SUBMITTED)
+    assert not job_failed (job_dir, 'idle')
+    dag = os.path.join (job_dir, 'jobs.dag')
+    for suffix in ('', '.dagman.out'):
+        open (dag + suffix, 'w').close ()
+    assert job_failed (job_dir, 'idle')
+    open (dag + '.lock', 'w').close ()
+    assert not job_failed (job_dir, 'idle')
@@ -0,0 +1,92 @@
+# test_shards.py
+
+"""Tests for splitting trials into jobs and merging their outputs."""
+
+import io
+import json
+import os
+import pickle
+
+import pytest
+
+from submitter import Submitter
+from submitter.submitter import condor_dag_label, merge_shards
+
+
+COMMAND = 'trials --n-trials {n_trials} --seed={seed}'
+LABEL = 'shard_{shard:03d}'
+
+
+@pytest.fixture
+def sub (tmp_path):
+    return Submitter (job_dir=str (tmp_path / 'jobs'), logfile=io.StringIO ())
+
+
+def test_shard_counts (sub):
+    commands, labels = sub.shard_trials (
+        COMMAND, LABEL, 10, target_runtime=30, seconds_per_trial=10)
+    assert commands == ['trials --n-trials 3 --seed=0',
+                        'trials --n-trials 3 --seed=1',
+                        'trials --n-trials 2 --seed=2',
+                        'trials --n-trials 2 --seed=3']
+    assert labels == ['shard_000', 'shard_001', 'shard_002', 'shard_003']
+    # a job runs at least one trial
+    commands, labels = sub.shard_trials (
+        COMMAND, LABEL, 2, target_runtime=1, seconds_per_trial=10, seed=100)
+    assert commands == ['trials --n-trials 1 --seed=100',
+                        'trials --n-trials 1 --seed=101']
+
+
+def test_seeds_continue_in_same_job_dir (sub):
+    sub.shard_trials (COMMAND, LABEL, 4, target_runtime=20,
+                      seconds_per_trial=10, seed=5)
+    commands, labels = sub.shard_trials (
+        COMMAND, LABEL, 4, target_runtime=20, seconds_per_trial=10)
+    assert commands == ['trials --n-trials 2 --seed=7',
+                        'trials --n-trials 2 --seed=8']
+    assert labels == ['shard_002', 'shard_003']
+    with open (os.path.join (sub.job_dir, 'shards.json')) as f:
+        shards = json.load (f)
+    assert sorted (shards) == ['shard_000', 'shard_001', 'shard_002',
+                               'shard_003']
+    assert shards['shard_003'] == dict (n_trials=2, seed=8, shard=3)
+
+
+def test_recorded_label_is_refused (sub):
+    sub.shard_trials (COMMAND, 'fixed', 1, target_runtime=10,
+                      seconds_per_trial=10)
+    with pytest.raises (ValueError):
+        sub.shard_trials (COMMAND, 'fixed', 1, target_runtime=10,
+                          seconds_per_trial=10)
+
+
+def test_merge_shards (tmp_path):
+    for i, part in enumerate ([[1, 2], [3], []]):
+        with open (str (tmp_path / 'out_{0}.pkl'.format (i)), 'wb') as f:
+            pickle.dump (part, f)
+    out = str (tmp_path / 'merged.pkl')
+    assert merge_shards (str (tmp_path / 'out_*.pkl'), out) == [1, 2, 3]
+    with open (out, 'rb') as f:
+        assert pickle.load (f) == [1, 2, 3]
+    assert merge_shards ([str (tmp_path / 'out_1.pkl')],
+                         load=lambda filename: 7, combine=sum) == 7
+    with pytest.raises (ValueError):
+        merge_shards (str (tmp_path / 'missing_*.pkl'))
+
+
+def test_seconds_per_trial_reads_old_and_new_records (sub):
+    log_dir = os.path.join (sub.job_dir, 'logs')
+    os.makedirs (log_dir)
+    with open (os.path.join (sub.job_dir, 'shards.json'), 'w') as f:
+        json.dump (dict (old=4, new=dict (n_trials=2, seed=0, shard=0)), f)
+    for label, minutes in (('old', '04'), ('new', '01')):
+        with open (os.path.join (
+                log_dir, condor_dag_label (label) + '.log'), 'w') as f:
+            f.write ('001 (7.000.000) 10/19 12:00:00 Job executing on host: '
+                     '<127.0.0.1>\n...\n'
+                     '005 (7.000.000) 10/19 12:{0}:00 Job terminated.\n'
+                     '\t(1) Normal termination (return value 0)\n'
+                     '...\n'.format (minutes))
+    # 60 s per trial for the old record, 30 s for the new; the median of
+    # two costs is the larger one
+    assert sub.seconds_per_trial () == 60
@@ -0,0 +1,79 @@
+# test_threads.py
+
+"""Tests for the admission of jobs by `Submitter.submit_threads`."""
+
+import glob
+import io
+import os
+
+import pytest
+
+from submitter import Submitter
+from submitter import submitter as submitter_module
+from submitter.submitter import SubmitLimiter, available_cores
+
+
+#: a job that prints its start and end times
+COMMAND = "sh -c 'date +%s.%N; sleep .5; date +%s.%N'"
+
+
+def run (tmp_path, n_jobs, monkeypatch, running=0, memory=None, **kwargs):
+    monkeypatch.setattr (submitter_module, 'running_threads', lambda: running)
+    monkeypatch.setattr (submitter_module, 'available_memory', lambda: memory)
+    sub = Submitter (job_dir=str (tmp_path / 'jobs'), logfile=io.StringIO (),
+                     memory=kwargs.pop ('job_memory', None))
+    sub.limiter = kwargs.pop ('limiter', None)
+    sub.submit_threads ([COMMAND] * n_jobs,
+                        ['job{0}'.format (i) for i in range (n_jobs)], **kwargs)
+    return max_overlap (str (tmp_path / 'jobs'))
+
+
+def max_overlap (job_dir):
+    events = []
+    for filename in glob.glob (os.path.join (job_dir, 'threads_*.out')):
+        with open (filename) as f:
+            start, end = [float (line) for line in f.read ().split ()[:2]]
+        events += [(start, 1), (end, -1)]
+    n = most = 0
+    for stamp, change in sorted (events):
+        n += change
+        most = max (most, n)
+    return most
+
+
+def test_cpu_budget (tmp_path, monkeypatch):
+    assert run (tmp_path, 4, monkeypatch, cpu_budget=2) == 2
+
+
+def test_foreign_load_holds_jobs_back (tmp_path, monkeypatch):
+    # the other threads leave room for only one job, which always runs
+    assert run (tmp_path, 2, monkeypatch, running=8, cpu_budget=4) == 1
+
+
+def test_memory_budget (tmp_path, monkeypatch):
+    assert run (tmp_path, 3, monkeypatch, memory=100., job_memory=2.,
+                cpu_budget=8, memory_budget=4.5) == 2
+
+
+def test_available_memory_holds_jobs_back (tmp_path, monkeypatch):
+    # the default budget is MemAvailable at submission
+    assert run (tmp_path, 2, monkeypatch, memory=3., job_memory=2.,
+                cpu_budget=8) == 1
+
+
+def test_limiter_budget (tmp_path, monkeypatch):
+    limiter = SubmitLimiter (str (tmp_path / 'limiter.json'), max_running=1)
+    assert run (tmp_path, 2, monkeypatch, cpu_budget=8, limiter=limiter) == 1
+    # the claims end with the jobs
+    assert limiter.acquire ('after', 1, block=False) == 1
+
+
+def test_pinning_refuses_too_many_cores (tmp_path):
+    sub = Submitter (job_dir=str (tmp_path / 'jobs'), logfile=io.StringIO ())
+    n_cores = len (available_cores ())
+    with pytest.raises (ValueError):
+        sub.submit_threads (['true'], ['a'], cpu_budget=n_cores + 1,
+                            pin_cpus=True)
+    sub.ncpu = n_cores + 1
+    with pytest.raises (ValueError):
+        sub.submit_threads (['true'], ['a'], pin_cpus=True)